@@ -1,4 +1,5 @@
 #include <string.h>
+#include <strings.h>
 #include "freertos/FreeRTOS.h"
 #include "freertos/task.h"
 #include "freertos/event_groups.h"
@@ -9,14 +10,27 @@
 #include "nvs_flash.h"
 #include "esp_netif.h"
 #include "esp_http_client.h"
-#include "cJSON.h" // has to be imported using idf.py
+#include "esp_timer.h"
 #include "driver/uart.h"
 #include "driver/gpio.h"
 
 #define ESP_WIFI_SSID      "example_wifi_ssid"
 #define ESP_WIFI_PASS      "example_wifi_pass"
 #define ESP_MAXIMUM_RETRY  5
-#define SERVER_URL         "http://RASPBERRY_WIFI_IP:5000/tag"
+#define FEEDER_ID          "feeder-1"
+#define SERVER_URL         "http://RASPBERRY_WIFI_IP:5000/tag/lean?feeder=" FEEDER_ID
+#define HINTS_URL          "http://RASPBERRY_WIFI_IP:5000/api/eligibility?format=lean"
+
+// First byte of a /tag/lean response; the second is the portion in seconds.
+#define SCAN_AUTHORIZED    0
+
+// Eligibility hints: scans of a pet that may not be fed for more than
+// HINT_MARGIN_S seconds are turned away here without asking the server.
+// Set USE_HINTS to 0 to send every scan, e.g. to have all denials logged.
+#define USE_HINTS          1
+#define MAX_HINTS          64
+#define HINT_REFRESH_MS    30000
+#define HINT_MARGIN_S      5
 
 #define UART_NUM           UART_NUM_1
 #define UART_RX_PIN        9
@@ -177,13 +191,23 @@ void stepper_rotate_for_seconds(int duration_seconds) {
 
 static char http_response_buffer[2048] = {0};
 static int http_response_index = 0;
+static bool http_response_full = false;
+static char http_etag[64] = {0};
 
 static esp_err_t http_event_handler(esp_http_client_event_t *evt) {
     switch(evt->event_id) {
+        case HTTP_EVENT_ON_HEADER:
+            if (strcasecmp(evt->header_key, "ETag") == 0) {
+                strlcpy(http_etag, evt->header_value, sizeof(http_etag));
+            }
+            break;
         case HTTP_EVENT_ON_DATA:
-            if (http_response_index + evt->data_len < sizeof(http_response_buffer)) {
+            // Keep a clean prefix: once a chunk does not fit, drop the rest.
+            if (!http_response_full && http_response_index + evt->data_len < sizeof(http_response_buffer)) {
                 memcpy(http_response_buffer + http_response_index, evt->data, evt->data_len);
                 http_response_index += evt->data_len;
+            } else {
+                http_response_full = true;
             }
             break;
         case HTTP_EVENT_ON_FINISH:
@@ -195,87 +219,174 @@ static esp_err_t http_event_handler(esp_http_client_event_t *evt) {
     return ESP_OK;
 }
 
+// One client for the lifetime of the firmware, so scans reuse the server
+// connection instead of opening a new one each time.
+static esp_http_client_handle_t http_client = NULL;
+
+static esp_http_client_handle_t get_http_client(void) {
+    if (http_client == NULL) {
+        esp_http_client_config_t config = {
+            .url = SERVER_URL,
+            .method = HTTP_METHOD_POST,
+            .event_handler = http_event_handler,
+            .keep_alive_enable = true,
+        };
+        http_client = esp_http_client_init(&config);
+        esp_http_client_set_header(http_client, "Content-Type", "application/octet-stream");
+    }
+    return http_client;
+}
+
+static void reset_http_client(void) {
+    if (http_client != NULL) {
+        esp_http_client_cleanup(http_client);
+        http_client = NULL;
+    }
+}
+
+static void reset_response(void) {
+    memset(http_response_buffer, 0, sizeof(http_response_buffer));
+    http_response_index = 0;
+    http_response_full = false;
+}
+
+typedef struct {
+    char uid[32];
+    int remaining;
+    int64_t eligible_us;  // esp_timer time from which the pet may be fed
+} pet_hint_t;
+
+static pet_hint_t hints[MAX_HINTS];
+static int hint_count = 0;
+static char hints_etag[64] = {0};
+static int64_t hints_fetched_us = 0;
+static bool hints_stale = true;
+static esp_http_client_handle_t hints_client = NULL;
+
+// Records of /api/eligibility?format=lean: UID length, UID, feeds left
+// today, then seconds until eligible as a big-endian uint32.
+static void parse_hints(int64_t now_us) {
+    const uint8_t *p = (const uint8_t *) http_response_buffer;
+    const uint8_t *end = p + http_response_index;
+    hint_count = 0;
+    while (hint_count < MAX_HINTS && p < end && p + 1 + p[0] + 5 <= end) {
+        int uid_len = p[0];
+        if (uid_len < (int) sizeof(hints[0].uid)) {
+            pet_hint_t *hint = &hints[hint_count++];
+            memcpy(hint->uid, p + 1, uid_len);
+            hint->uid[uid_len] = '\0';
+            const uint8_t *q = p + 1 + uid_len;
+            uint32_t wait_s = ((uint32_t) q[1] << 24) | ((uint32_t) q[2] << 16) | ((uint32_t) q[3] << 8) | q[4];
+            hint->remaining = q[0];
+            hint->eligible_us = now_us + (int64_t) wait_s * 1000000;
+        }
+        p += 1 + uid_len + 5;
+    }
+}
+
+static void refresh_hints(void) {
+    int64_t now_us = esp_timer_get_time();
+    if (!hints_stale && now_us - hints_fetched_us < (int64_t) HINT_REFRESH_MS * 1000) {
+        return;
+    }
+    if (hints_client == NULL) {
+        esp_http_client_config_t config = {
+            .url = HINTS_URL,
+            .method = HTTP_METHOD_GET,
+            .event_handler = http_event_handler,
+            .keep_alive_enable = true,
+            .timeout_ms = 2000,
+        };
+        hints_client = esp_http_client_init(&config);
+    }
+    // The server answers 304 while nothing changed; the table then stays.
+    if (hints_etag[0] != '\0') {
+        esp_http_client_set_header(hints_client, "If-None-Match", hints_etag);
+    }
+
+    reset_response();
+    http_etag[0] = '\0';
+    esp_err_t err = esp_http_client_perform(hints_client);
+    // Whatever the outcome, try again after HINT_REFRESH_MS at the latest.
+    hints_fetched_us = now_us;
+    hints_stale = false;
+    if (err != ESP_OK) {
+        ESP_LOGW(TAG, "Hints failed: %s", esp_err_to_name(err));
+        esp_http_client_cleanup(hints_client);
+        hints_client = NULL;
+        return;
+    }
+
+    if (esp_http_client_get_status_code(hints_client) == 200) {
+        parse_hints(now_us);
+        strlcpy(hints_etag, http_etag, sizeof(hints_etag));
+        ESP_LOGI(TAG, "Hints: %d pets", hint_count);
+    }
+}
+
+static const pet_hint_t *find_hint(const char *uid) {
+    for (int i = 0; i < hint_count; i++) {
+        if (strcmp(hints[i].uid, uid) == 0) {
+            return &hints[i];
+        }
+    }
+    return NULL;
+}
+
 esp_err_t send_uid_to_server(char* uid_data) {
     if (motor_busy) {
         ESP_LOGW(TAG, "Motor busy");
         return ESP_OK;
     }
 
-    esp_http_client_config_t config = {
-        .url = SERVER_URL,
-        .method = HTTP_METHOD_POST,
-        .event_handler = http_event_handler,
-    };
-    esp_http_client_handle_t client = esp_http_client_init(&config);
-
-    char post_data[128];
     uid_data[strcspn(uid_data, "\r\n")] = '\0';
-    snprintf(post_data, sizeof(post_data), "{\"uid\":\"%s\"}", uid_data);
+    const pet_hint_t *hint = USE_HINTS ? find_hint(uid_data) : NULL;
+    if (hint != NULL) {
+        int64_t wait_seconds = (hint->eligible_us - esp_timer_get_time()) / 1000000;
+        if (wait_seconds > HINT_MARGIN_S) {
+            ESP_LOGI(TAG, "Not eligible for %lld s (%d feeds left today), not asking",
+                     (long long) wait_seconds, hint->remaining);
+            return ESP_OK;
+        }
+    }
 
-    esp_http_client_set_header(client, "Content-Type", "application/json");
-    esp_http_client_set_post_field(client, post_data, strlen(post_data));
+    esp_http_client_handle_t client = get_http_client();
+    esp_http_client_set_post_field(client, uid_data, strlen(uid_data));
 
-    memset(http_response_buffer, 0, sizeof(http_response_buffer));
-    http_response_index = 0;
+    reset_response();
 
     esp_err_t err = esp_http_client_perform(client);
-    if (err == ESP_OK) {
-        int statusCode = esp_http_client_get_status_code(client);
-        ESP_LOGI(TAG, "Status: %d", statusCode);
-
-        if (statusCode == 200) {
-            cJSON *root = cJSON_Parse(http_response_buffer);
-            if (root == NULL) {
-                ESP_LOGE(TAG, "JSON parse failed");
-                esp_http_client_cleanup(client);
-                return ESP_FAIL;
-            }
-
-            cJSON *status_item = cJSON_GetObjectItem(root, "status");
-            if (status_item == NULL || !cJSON_IsString(status_item)) {
-                ESP_LOGW(TAG, "No status field");
-                cJSON_Delete(root);
-                esp_http_client_cleanup(client);
-                return ESP_OK;
-            }
-
-            char *status_str = status_item->valuestring;
-            ESP_LOGI(TAG, "Status: %s", status_str);
-
-            if (strcmp(status_str, "authorized") != 0) {
-                ESP_LOGI(TAG, "Not authorized, skipping dispense");
-                cJSON_Delete(root);
-                esp_http_client_cleanup(client);
-                return ESP_OK;
-            }
+    if (err != ESP_OK) {
+        ESP_LOGE(TAG, "HTTP failed: %s", esp_err_to_name(err));
+        // Start over with a fresh connection on the next scan.
+        reset_http_client();
+        return err;
+    }
 
-            cJSON *seconds_item = cJSON_GetObjectItem(root, "portion_time");
-            if (seconds_item == NULL) {
-                seconds_item = cJSON_GetObjectItem(root, "seconds");
-            }
-            if (seconds_item == NULL) {
-                seconds_item = cJSON_GetObjectItem(root, "duration");
-            }
+    int statusCode = esp_http_client_get_status_code(client);
+    ESP_LOGI(TAG, "Status: %d", statusCode);
+    if (statusCode != 200 || http_response_index < 2) {
+        ESP_LOGW(TAG, "Unexpected response");
+        return ESP_OK;
+    }
 
-            int rotation_seconds = 2;
-            if (seconds_item != NULL && cJSON_IsNumber(seconds_item)) {
-                rotation_seconds = seconds_item->valueint;
-                ESP_LOGI(TAG, "Portion time: %d s", rotation_seconds);
-            }
+    int outcome = (uint8_t) http_response_buffer[0];
+    int rotation_seconds = (uint8_t) http_response_buffer[1];
+    if (outcome != SCAN_AUTHORIZED) {
+        ESP_LOGI(TAG, "Not authorized (%d), skipping dispense", outcome);
+        return ESP_OK;
+    }
 
-            if (rotation_seconds < 1 || rotation_seconds > 30) {
-                rotation_seconds = 2;
-            }
+    // The pet's cooldown and quota just changed.
+    hints_stale = true;
 
-            stepper_rotate_for_seconds(rotation_seconds);
-            cJSON_Delete(root);
-        }
-    } else {
-        ESP_LOGE(TAG, "HTTP failed: %s", esp_err_to_name(err));
+    ESP_LOGI(TAG, "Portion time: %d s", rotation_seconds);
+    if (rotation_seconds < 1 || rotation_seconds > 30) {
+        rotation_seconds = 2;
     }
 
-    esp_http_client_cleanup(client);
-    return err;
+    stepper_rotate_for_seconds(rotation_seconds);
+    return ESP_OK;
 }
 
 static void uart_rx_task(void *arg) {
@@ -286,6 +397,9 @@ static void uart_rx_task(void *arg) {
             data[len] = '\0';
             ESP_LOGI(TAG, "UID: %s", (char*)data);
             send_uid_to_server((char*)data);
+        } else if (USE_HINTS) {
+            // Only between scans, so fetching never delays one.
+            refresh_hints();
         }
     }
 }
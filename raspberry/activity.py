@@ -0,0 +1,131 @@
+from logformat import format_entry
+
+INSERT_LOG = "INSERT INTO feeding_logs (pet_id, event, value, note, timestamp) VALUES (?, ?, ?, ?, ?)"
+
+GROUP_QUERY = """
+    SELECT g.id AS group_id, g.last_log_id AS id, p.name AS pet_name, g.event, g.value, g.note, g.timestamp, g.count
+    FROM log_groups g LEFT JOIN pets p ON p.id = g.pet_id
+"""
+
+
+def _same_run(group, pet_id, event, value, note):
+    return group is not None and (group["pet_id"], group["event"], group["value"], group["note"]) == \
+        (pet_id, event, value, note)
+
+
+def head_group(db):
+    row = db.execute(
+        "SELECT id, pet_id, event, value, note, count FROM log_groups ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    if row is None:
+        return None
+    return {"id": row[0], "pet_id": row[1], "event": row[2], "value": row[3], "note": row[4], "count": row[5]}
+
+
+def append_logs(db, rows):
+    """Insert feeding_logs rows and fold them into log_groups.
+
+    Rows are (pet_id, pet_name, event, value, note, timestamp); pet_name is
+    only carried along for commit listeners, the tables reference pets.
+    Consecutive rows for the same pet with the same event, value and note
+    bump the newest group's counter instead of starting a new one, so the
+    dashboard feed is a plain read of the newest groups. Must run inside
+    the caller's write transaction. Returns (log_id, group_id, count) per row.
+    """
+    group = head_group(db)
+    results = []
+    for pet_id, _, event, value, note, timestamp in rows:
+        log_id = db.execute(INSERT_LOG, (pet_id, event, value, note, timestamp)).lastrowid
+
+        if _same_run(group, pet_id, event, value, note):
+            group["count"] += 1
+            db.execute(
+                "UPDATE log_groups SET count = ?, last_log_id = ?, timestamp = ? WHERE id = ?",
+                (group["count"], log_id, timestamp, group["id"])
+            )
+        else:
+            group_id = db.execute("""
+                INSERT INTO log_groups (pet_id, event, value, note, timestamp, count, first_log_id, last_log_id)
+                VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+            """, (pet_id, event, value, note, timestamp, log_id, log_id)).lastrowid
+            group = {"id": group_id, "pet_id": pet_id, "event": event, "value": value, "note": note, "count": 1}
+
+        results.append((log_id, group["id"], group["count"]))
+    return results
+
+
+def add_repeats(db, items):
+    """Count debounced repeat scans into the group of the row they repeated.
+
+    Items are (pet_id, event, note, timestamp, repeats) as handed out by
+    ScanDebouncer. The repeats get no feeding_logs rows of their own; they
+    only raise the group's count, the way the scans used to when each one
+    was logged. Must run inside the caller's write transaction. Returns
+    {group_id: count} for the groups that changed, for live updates.
+    """
+    counts = {}
+    for pet_id, event, note, timestamp, repeats in items:
+        row = db.execute(
+            "SELECT id FROM feeding_logs WHERE timestamp = ? AND event = ? AND pet_id IS ? AND note IS ? "
+            "ORDER BY id DESC LIMIT 1", (timestamp, event, pet_id, note)
+        ).fetchone()
+        if row is None:
+            # Cleared or deleted in the meantime.
+            continue
+        group = db.execute(
+            "SELECT id, count FROM log_groups WHERE last_log_id >= ? AND first_log_id <= ? "
+            "ORDER BY last_log_id LIMIT 1", (row[0], row[0])
+        ).fetchone()
+        if group is None:
+            continue
+        counts[group[0]] = counts.get(group[0], group[1]) + repeats
+        db.execute("UPDATE log_groups SET count = ? WHERE id = ?", (counts[group[0]], group[0]))
+    return counts
+
+
+def rebuild_groups(db, chunk_size=10000):
+    db.execute("DELETE FROM log_groups")
+    group = None
+    cursor = db.execute(
+        "SELECT id, pet_id, event, value, note, timestamp FROM feeding_logs ORDER BY timestamp, id"
+    )
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            break
+        for log_id, pet_id, event, value, note, timestamp in chunk:
+            if _same_run(group, pet_id, event, value, note):
+                group["count"] += 1
+                group["last_log_id"] = log_id
+                group["timestamp"] = timestamp
+                continue
+            if group is not None:
+                _insert_group(db, group)
+            group = {"pet_id": pet_id, "event": event, "value": value, "note": note,
+                     "timestamp": timestamp, "count": 1, "first_log_id": log_id, "last_log_id": log_id}
+    if group is not None:
+        _insert_group(db, group)
+
+
+def _insert_group(db, group):
+    db.execute("""
+        INSERT INTO log_groups (pet_id, event, value, note, timestamp, count, first_log_id, last_log_id)
+        VALUES (:pet_id, :event, :value, :note, :timestamp, :count, :first_log_id, :last_log_id)
+    """, group)
+
+
+def _format_groups(rows):
+    return [dict(format_entry(pet_name, event, value, note, timestamp), group_id=group_id, id=log_id, count=count)
+            for group_id, log_id, pet_name, event, value, note, timestamp, count in rows]
+
+
+def recent_groups(db, limit=20):
+    return _format_groups(db.execute(
+        f"{GROUP_QUERY} ORDER BY g.id DESC LIMIT ?", (limit,)
+    ).fetchall())
+
+
+def groups_since(db, log_id, limit=20):
+    return _format_groups(db.execute(
+        f"{GROUP_QUERY} WHERE g.last_log_id > ? ORDER BY g.id DESC LIMIT ?", (log_id, limit)
+    ).fetchall())
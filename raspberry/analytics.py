@@ -0,0 +1,176 @@
+from datetime import date, datetime, timedelta, timezone
+
+from logformat import DISPENSED, DENIED_DAILY_LIMIT, DENIED_COOLDOWN, DENIED_UNKNOWN, format_timestamp, to_epoch_ms
+
+HOUR_MS = 3600000
+DAY_MS = 24 * HOUR_MS
+BUCKET_MS = {"day": DAY_MS, "hour": HOUR_MS}
+
+COUNTERS = ("dispensed", "denied", "portion_seconds", "daily_limit_denials", "cooldown_denials", "unknown_denials")
+
+# Upper bounds, in minutes left, of the cooldown-hit histogram bins.
+COOLDOWN_BINS = (5, 15, 30, 60, 120)
+
+# SQLite buckets and pivots the raw rows, one output row per pet and bucket
+# with the COUNTERS in order, so Python never iterates individual log rows.
+# Buckets are local days or hours: timestamps are shifted by the UTC offset
+# of the segment being queried.
+BUCKET_COUNTS = f"""
+    SELECT COALESCE(pet_id, 0), (timestamp + ?) / ?,
+           SUM(event = {DISPENSED}), SUM(event != {DISPENSED}),
+           COALESCE(SUM(CASE WHEN event = {DISPENSED} THEN value END), 0),
+           SUM(event = {DENIED_DAILY_LIMIT}), SUM(event = {DENIED_COOLDOWN}), SUM(event = {DENIED_UNKNOWN})
+    FROM feeding_logs
+    WHERE timestamp >= ? AND timestamp < ? {{pets}}
+    GROUP BY 1, 2
+"""
+COOLDOWN_COUNTS = f"""
+    SELECT pet_id, value, COUNT(*)
+    FROM feeding_logs
+    WHERE event = {DENIED_COOLDOWN} AND timestamp >= ? AND timestamp < ? {{pets}}
+    GROUP BY 1, 2
+"""
+ROLLUPS = f"""
+    SELECT pet_id, pet_name, day, {", ".join(COUNTERS)}
+    FROM daily_rollups
+    WHERE day >= ? AND day < ? {{pets}}
+"""
+
+
+def _cooldown_labels():
+    labels, low = [], 0
+    for high in COOLDOWN_BINS:
+        labels.append(f"{low}-{high - 1}")
+        low = high
+    return labels + [f"{low}+"]
+
+
+COOLDOWN_LABELS = _cooldown_labels()
+
+
+def _pet_filter(pet_ids, column="pet_id"):
+    if not pet_ids:
+        return "", ()
+    return f"AND {column} IN ({', '.join('?' * len(pet_ids))})", tuple(pet_ids)
+
+
+def _utc_offset_ms(ms):
+    return int(datetime.fromtimestamp(ms // 1000, timezone.utc).astimezone().utcoffset().total_seconds()) * 1000
+
+
+def offset_segments(start_ms, end_ms):
+    """Split [start_ms, end_ms) wherever the local UTC offset changes (DST).
+
+    Returns (start, end, offset) triples; within each one a local day or
+    hour is plain integer division of timestamp + offset.
+    """
+    segments = []
+    segment_start, offset = start_ms, _utc_offset_ms(start_ms)
+    probe = start_ms
+    while probe < end_ms:
+        step_end = min(probe + DAY_MS, end_ms)
+        if _utc_offset_ms(step_end - 1) == offset:
+            probe = step_end
+            continue
+        change = probe
+        while _utc_offset_ms(change) == offset:
+            change += HOUR_MS
+        segments.append((segment_start, change, offset))
+        segment_start, offset, probe = change, _utc_offset_ms(change), change
+    segments.append((segment_start, end_ms, offset))
+    return segments
+
+
+def _bucket_label(bucket, index):
+    if bucket == "day":
+        return (date(1970, 1, 1) + timedelta(days=index)).isoformat()
+    return (datetime(1970, 1, 1) + timedelta(hours=index)).strftime('%Y-%m-%d %H:00')
+
+
+def pet_analytics(db, start, end, bucket="day", pet_ids=None):
+    """Per-pet feeding series and totals for local datetimes [start, end).
+
+    Dispenses, denials by reason and portion seconds are counted per day or
+    hour, plus a histogram of how many minutes were left when a scan hit
+    the cooldown. Days that retention has already pruned come from
+    daily_rollups, so they only show up in daily series and carry no
+    cooldown histogram; `raw_since` tells where the raw log starts.
+    """
+    if bucket not in BUCKET_MS:
+        raise ValueError("bucket must be 'day' or 'hour'")
+    pets_sql, pets_args = _pet_filter(pet_ids)
+    start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+
+    report = {}
+
+    def pet_entry(pet_id, name=None):
+        entry = report.get(pet_id)
+        if entry is None:
+            entry = report[pet_id] = {"pet_id": pet_id, "pet_name": name, "series": {},
+                                      "cooldown_minutes_left": [0] * len(COOLDOWN_LABELS)}
+        elif entry["pet_name"] is None:
+            entry["pet_name"] = name
+        return entry
+
+    def add(entry, label, values):
+        counters = entry["series"].get(label)
+        if counters is None:
+            entry["series"][label] = dict(zip(COUNTERS, (value or 0 for value in values)))
+        else:
+            for key, value in zip(COUNTERS, values):
+                counters[key] += value or 0
+
+    known_sql, _ = _pet_filter(pet_ids, column="id")
+    for pet_id, name in db.execute(f"SELECT id, name FROM pets WHERE 1 {known_sql}", pets_args):
+        pet_entry(pet_id, name)
+    if not pet_ids:
+        pet_entry(0, "Unknown")
+
+    labels = {}
+    query = BUCKET_COUNTS.format(pets=pets_sql)
+    for segment_start, segment_end, offset in offset_segments(start_ms, end_ms):
+        for pet_id, index, *values in db.execute(
+                query, (offset, BUCKET_MS[bucket], segment_start, segment_end) + pets_args):
+            label = labels.get(index)
+            if label is None:
+                label = labels[index] = _bucket_label(bucket, index)
+            add(pet_entry(pet_id), label, values)
+
+    if bucket == "day":
+        for pet_id, name, day, *values in db.execute(
+                ROLLUPS.format(pets=pets_sql), (start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')) + pets_args):
+            add(pet_entry(pet_id, name), day, values)
+
+    for pet_id, minutes_left, count in db.execute(
+            COOLDOWN_COUNTS.format(pets=pets_sql), (start_ms, end_ms) + pets_args):
+        histogram = pet_entry(pet_id)["cooldown_minutes_left"]
+        index = next((i for i, high in enumerate(COOLDOWN_BINS) if (minutes_left or 0) < high), len(COOLDOWN_BINS))
+        histogram[index] += count
+
+    # Unknown tags only get an entry when there were any.
+    unknown = report.get(0)
+    if unknown is not None and not unknown["series"]:
+        del report[0]
+
+    raw_since = db.execute("SELECT MIN(timestamp) FROM feeding_logs").fetchone()[0]
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "bucket": bucket,
+        "raw_since": format_timestamp(raw_since) if raw_since is not None else None,
+        "pets": [_finish(report[pet_id]) for pet_id in sorted(report)],
+    }
+
+
+def _finish(entry):
+    series = [dict(counters, bucket=label) for label, counters in sorted(entry["series"].items())]
+    totals = {key: sum(counters[key] for counters in series) for key in COUNTERS}
+    scans = totals["dispensed"] + totals["denied"]
+    totals["denial_rate"] = round(totals["denied"] / scans, 4) if scans else None
+    return {
+        "pet_id": entry["pet_id"],
+        "pet_name": entry["pet_name"],
+        "totals": totals,
+        "series": series,
+        "cooldown_minutes_left": dict(zip(COOLDOWN_LABELS, entry["cooldown_minutes_left"])),
+    }
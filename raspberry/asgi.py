@@ -0,0 +1,311 @@
+"""asyncio serving mode for large feeder fleets.
+
+Serves the same endpoints as server.py through Starlette instead of the Flask
+development server, so idle feeder connections and dashboard streams cost a
+coroutine rather than a thread. Blocking SQLite work runs on a bounded thread
+pool. Requires `pip install starlette uvicorn python-multipart`, then:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --timeout-keep-alive 60
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import server
+from metrics import registry, REQUEST_SECONDS
+
+# Threads running SQLite work. At most DB_MAX_PENDING calls are queued or
+# running at once; further requests wait on the event loop.
+DB_EXECUTOR_WORKERS = server.DB_POOL_SIZE
+DB_MAX_PENDING = 64
+
+executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+db_slots = asyncio.Semaphore(DB_MAX_PENDING)
+
+
+def _with_connection(handler, args):
+    db = server.pool.acquire()
+    try:
+        return handler(db, *args)
+    finally:
+        server.pool.release(db)
+
+
+async def run_db(handler, *args):
+    async with db_slots:
+        return await asyncio.get_running_loop().run_in_executor(executor, _with_connection, handler, args)
+
+
+class AsyncBus:
+    """Wakes stream coroutines when the thread-side EventBus changes."""
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.loop = None
+        self._waiters = set()
+        bus.add_listener(self._changed)
+
+    def _changed(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    async def wait(self, cursor, timeout):
+        waiter = self.loop.create_future()
+        self._waiters.add(waiter)
+        try:
+            # Registered before checking, so a publish in between still wakes us.
+            events, head = self.bus.wait(cursor, 0)
+            if events or head != cursor:
+                return events, head
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self.bus.wait(cursor, 0)
+        finally:
+            self._waiters.discard(waiter)
+
+
+async_bus = AsyncBus(server.bus)
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    tags = {tag.strip() for tag in header.split(",")}
+    return "*" in tags or f'"{etag}"' in tags or f'W/"{etag}"' in tags
+
+
+def timed(route, endpoint):
+    async def handle(request):
+        started = time.perf_counter()
+        status = "500"
+        try:
+            response = await endpoint(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route, status)
+    return handle
+
+
+async def scan(request):
+    body, status = await run_db(server.handle_scan, await read_json(request))
+    return JSONResponse(body, status_code=status)
+
+
+async def scan_lean(request):
+    body, status = await run_db(server.handle_lean_scan, await request.body(), request.query_params.get("feeder"))
+    return Response(body, status_code=status, media_type=server.lean.CONTENT_TYPE)
+
+
+async def eligibility(request):
+    fmt = request.query_params.get("format", "json")
+    if fmt not in server.HINT_FORMATS:
+        return JSONResponse({"error": f"format must be one of {', '.join(server.HINT_FORMATS)}"}, status_code=400)
+    if_none_match = request.headers.get("if-none-match")
+
+    def load(db):
+        now = datetime.now()
+        etag = server.eligibility_etag(db, now)
+        if etag_matches(if_none_match, etag):
+            return etag, None
+        return etag, server.load_hints(fmt, now)
+
+    etag, hints = await run_db(load)
+    headers = {"ETag": f'W/"{etag}"'}
+    if hints is None:
+        return Response(status_code=304, headers=headers)
+    if fmt == "json":
+        return JSONResponse(hints, headers=headers)
+    return Response(hints, media_type=server.HINT_FORMATS[fmt], headers=headers)
+
+
+async def scan_batch(request):
+    body, status = await run_db(server.handle_batch, await read_json(request))
+    return JSONResponse(body, status_code=status)
+
+
+async def get_logs(request):
+    since = int_or_none(request.query_params.get("since"))
+    client_generation = int_or_none(request.query_params.get("generation"))
+    if_none_match = request.headers.get("if-none-match")
+
+    def load(db):
+        etag, generation, head = server.log_etag(db)
+        if etag_matches(if_none_match, etag):
+            return etag, None
+        return etag, server.load_logs(db, generation, head, since=since, client_generation=client_generation)
+
+    etag, logs = await run_db(load)
+    headers = {"ETag": f'"{etag}"'}
+    if logs is None:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(logs, headers=headers)
+
+
+async def stream_logs(request):
+    cursor = server.bus.cursor(int_or_none(request.headers.get("last-event-id")))
+
+    async def generate(cursor):
+        yield "retry: 3000\n\n"
+        while True:
+            if cursor is None:
+                yield "event: reset\ndata: {}\n\n"
+                cursor = server.bus.cursor()
+            events, cursor = await async_bus.wait(cursor, server.STREAM_HEARTBEAT)
+            if cursor is None:
+                continue
+            if not events:
+                yield ": heartbeat\n\n"
+                continue
+            yield server.format_events(events)
+
+    return StreamingResponse(generate(cursor), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def metrics(request):
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+async def analytics(request):
+    body, status = await run_db(server.handle_analytics, request.query_params)
+    return JSONResponse(body, status_code=status)
+
+
+async def export_logs(request):
+    export, status = server.handle_export(request.query_params)
+    if status != 200:
+        return JSONResponse(export, status_code=status)
+
+    async def generate():
+        yield await run_db(export.start)
+        while (chunk := await run_db(export.next_chunk)) is not None:
+            yield chunk
+
+    return StreamingResponse(generate(), media_type=export.content_type, headers=server.export_headers(export))
+
+
+async def clear_logs(request):
+    return JSONResponse(await run_db(server.handle_clear_logs))
+
+
+async def index(request):
+    html = server.cached_dashboard() or await run_db(server.render_dashboard)
+    return HTMLResponse(html)
+
+
+async def start_registration(request):
+    feeder = request.query_params.get("feeder")
+    return JSONResponse(await run_db(server.begin_registration, feeder))
+
+
+async def get_captured_uid(request):
+    feeder = request.query_params.get("feeder")
+    return JSONResponse(await run_db(server.take_captured_uid, feeder))
+
+
+async def register_pet(request):
+    form = await request.form()
+    body, status = await run_db(server.handle_register, form)
+    return HTMLResponse(body, status_code=status)
+
+
+async def import_pets(request):
+    text = (await request.body()).decode("utf-8", errors="replace")
+    body, status = await run_db(server.handle_import_pets, text, request.query_params,
+                                request.headers.get("content-type"))
+    return JSONResponse(body, status_code=status)
+
+
+async def export_pets(request):
+    body, status = await run_db(server.handle_export_pets, request.query_params)
+    if status != 200:
+        return JSONResponse(body, status_code=status)
+    fmt = request.query_params.get("format", "csv")
+    return Response(body, media_type=server.PET_FORMATS[fmt], headers=server.pet_export_headers(fmt))
+
+
+async def delete_pets(request):
+    body, status = await run_db(server.handle_delete_pets, await read_json(request))
+    return JSONResponse(body, status_code=status)
+
+
+async def delete_pet(request):
+    return JSONResponse(await run_db(server.handle_delete_pet, request.path_params["pet_id"]))
+
+
+async def startup():
+    async_bus.loop = asyncio.get_running_loop()
+    await run_db(server.migrate_db)
+    await run_db(server.engine.warm)
+    server.retention.start()
+    server.purger.start()
+
+
+async def shutdown():
+    server.retention.stop()
+    server.purger.stop()
+    server.log_writer.submit_repeats(server.debouncer.drain())
+    await asyncio.get_running_loop().run_in_executor(None, server.log_writer.close)
+    executor.shutdown(wait=True)
+
+
+ROUTES = [
+    ("/tag", scan, ["POST"]),
+    ("/tag/lean", scan_lean, ["POST"]),
+    ("/tag/batch", scan_batch, ["POST"]),
+    ("/api/eligibility", eligibility, ["GET"]),
+    ("/api/logs", get_logs, ["GET"]),
+    ("/api/logs/stream", stream_logs, ["GET"]),
+    ("/api/logs/export", export_logs, ["GET"]),
+    ("/api/logs/clear", clear_logs, ["POST"]),
+    ("/api/analytics", analytics, ["GET"]),
+    ("/metrics", metrics, ["GET"]),
+    ("/", index, ["GET"]),
+    ("/start_registration", start_registration, ["POST"]),
+    ("/get_captured_uid", get_captured_uid, ["GET"]),
+    ("/register", register_pet, ["POST"]),
+    ("/delete/{pet_id:int}", delete_pet, ["POST"]),
+    ("/api/pets/import", import_pets, ["POST"]),
+    ("/api/pets/export", export_pets, ["GET"]),
+    ("/api/pets/delete", delete_pets, ["POST"]),
+]
+
+app = Starlette(
+    routes=[Route(path, timed(path, endpoint), methods=methods) for path, endpoint, methods in ROUTES],
+    on_startup=[startup],
+    on_shutdown=[shutdown],
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=5000, timeout_keep_alive=server.KEEPALIVE_TIMEOUT)
@@ -0,0 +1,67 @@
+"""/api/analytics query time over a year of history.
+
+Seeds a temporary database through loadgen's seeder, optionally lets
+retention roll up everything older than --keep-days, then times
+pet_analytics() for a few typical requests.
+
+    python bench/bench_analytics.py --pets 40 --months 12 --keep-days 90
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from analytics import pet_analytics
+from loadgen import seed
+from retention import RetentionWorker
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pets", type=int, default=40)
+    parser.add_argument("--months", type=float, default=12)
+    parser.add_argument("--keep-days", type=int, help="roll up and prune logs older than this first")
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "pets.db")
+        started = time.perf_counter()
+        _, events = seed(db_path, args.pets, args.months)
+        print(f"Seeded {args.pets} pets and {events} log rows in {time.perf_counter() - started:.1f}s")
+
+        if args.keep_days:
+            worker = RetentionWorker(lambda: sqlite3.connect(db_path), days=args.keep_days,
+                                     archive_dir=os.path.join(tmp, "archive"), chunk_size=5000, pause=0)
+            started = time.perf_counter()
+            pruned = worker.run_once()
+            print(f"Rolled up {pruned} rows older than {args.keep_days} days in {time.perf_counter() - started:.1f}s")
+
+        db = sqlite3.connect(db_path)
+        end = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        cases = [
+            ("year, daily, all pets", end - timedelta(days=365), "day", None),
+            ("30 days, hourly, all pets", end - timedelta(days=30), "hour", None),
+            ("year, daily, one pet", end - timedelta(days=365), "day", [1]),
+        ]
+        print(f"\n{'request':<28} {'best ms':>9} {'worst ms':>9} {'pets':>5} {'points':>7}")
+        for label, start, bucket, pet_ids in cases:
+            samples = []
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                report = pet_analytics(db, start, end, bucket=bucket, pet_ids=pet_ids)
+                samples.append(time.perf_counter() - started)
+            points = sum(len(pet["series"]) for pet in report["pets"])
+            print(f"{label:<28} {min(samples) * 1000:>9.1f} {max(samples) * 1000:>9.1f} "
+                  f"{len(report['pets']):>5} {points:>7}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Round trips saved by feeders that check /api/eligibility before scanning.
+
+Starts server.py (or asgi.py) on a seeded temporary database and replays one
+feeder's scans twice over a kept-alive connection: once sending every scan
+to /tag/lean, once the way the firmware does with USE_HINTS, turning away
+scans of pets that may not be fed for a while and refetching the hints
+after every dispense. Reports requests and bytes received per scan and the
+mean time per scan, then re-sends every scan that was turned away to check
+the server denies it too.
+
+    python bench/bench_hints.py --scans 2000 --mix authorized=10,cooldown=60,daily_limit=30
+"""
+import argparse
+import http.client
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from loadgen import free_port, parse_mix, seed, start_server
+
+# Seconds a pet must still be out of reach for the feeder to skip the server,
+# as HINT_MARGIN_S in the firmware.
+MARGIN_S = 5
+
+
+class Feeder:
+    def __init__(self, port, hints):
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        self.use_hints = hints
+        self.requests = 0
+        self.received = 0
+        self.local = []
+        self.table = {}
+        self.etag = None
+        self.stale = True
+
+    def get(self, method, path, body=None, headers=None):
+        self.connection.request(method, path, body=body, headers=headers or {})
+        response = self.connection.getresponse()
+        data = response.read()
+        self.requests += 1
+        self.received += len(data)
+        return response, data
+
+    def refresh(self):
+        response, data = self.get("GET", "/api/eligibility?format=lean",
+                                  headers={"If-None-Match": self.etag} if self.etag else None)
+        self.stale = False
+        if response.status != 200:
+            return
+        self.etag = response.getheader("ETag")
+        now, self.table, i = time.monotonic(), {}, 0
+        while i < len(data):
+            length = data[i]
+            uid = data[i + 1:i + 1 + length].decode("ascii")
+            wait_s = int.from_bytes(data[i + 2 + length:i + 6 + length], "big")
+            self.table[uid] = now + wait_s
+            i += 6 + length
+
+    def scan(self, uid):
+        if self.use_hints:
+            if self.stale:
+                self.refresh()
+            if self.table.get(uid, 0) - time.monotonic() > MARGIN_S:
+                self.local.append(uid)
+                return
+        _, data = self.get("POST", "/tag/lean?feeder=bench", body=uid.encode("ascii"),
+                           headers={"Content-Type": "application/octet-stream"})
+        if data[0] == 0:
+            self.stale = True
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scans", type=int, default=2000)
+    parser.add_argument("--pets", type=int, default=30)
+    parser.add_argument("--mix", default="authorized=10,cooldown=60,daily_limit=30")
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "pets.db")
+        uids, _ = seed(db_path, args.pets, 1)
+        kinds = [kind for kind in weights if uids.get(kind)]
+        if not kinds:
+            raise SystemExit("--mix needs at least one of authorized, cooldown, daily_limit")
+        rng = random.Random(1)
+        scans = [rng.choice(uids[kind]) for kind in rng.choices(kinds, [weights[k] for k in kinds], k=args.scans)]
+        port = free_port()
+        process = start_server(args.server, db_path, port)
+        try:
+            print(f"{'mode':<12} {'requests/scan':>14} {'bytes/scan':>11} {'ms/scan':>8} {'local':>7}")
+            for label, hints in (("ask always", False), ("hints", True)):
+                feeder = Feeder(port, hints)
+                started = time.perf_counter()
+                for uid in scans:
+                    feeder.scan(uid)
+                elapsed = time.perf_counter() - started
+                feeder.close()
+                print(f"{label:<12} {feeder.requests / len(scans):>14.2f} {feeder.received / len(scans):>11.1f} "
+                      f"{elapsed / len(scans) * 1000:>8.3f} {len(feeder.local) / len(scans):>7.0%}")
+
+            check = Feeder(port, False)
+            for uid in set(feeder.local):
+                _, data = check.get("POST", "/tag/lean?feeder=check", body=uid.encode("ascii"))
+                if data[0] == 0:
+                    raise SystemExit(f"{uid} was turned away locally but the server authorized it")
+            check.close()
+            print(f"{len(set(feeder.local))} pets turned away locally, all denied by the server as well")
+        finally:
+            process.terminate()
+            process.wait(10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Scan query latency vs. feeding_logs size, before the index migration (string
+timestamps, no indexes) and at the current schema (indexes, integer timestamps).
+
+    python bench/bench_indexes.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logformat import DISPENSED, TIMESTAMP_FORMAT, day_start_ms
+from migrations import migrate
+
+PETS = 50
+
+# The same two lookups against the string-typed schema of migrations 1-8
+# and against the compact one.
+LEGACY_QUERIES = (
+    "SELECT COUNT(*) FROM feeding_logs WHERE pet_id = ? AND event_type = 'Dispensed' AND timestamp >= ?",
+    "SELECT timestamp FROM feeding_logs WHERE pet_id = ? AND event_type = 'Dispensed' ORDER BY timestamp DESC LIMIT 1",
+)
+COMPACT_QUERIES = (
+    f"SELECT COUNT(*) FROM feeding_logs WHERE pet_id = ? AND event = {DISPENSED} AND timestamp >= ?",
+    f"SELECT timestamp FROM feeding_logs WHERE pet_id = ? AND event = {DISPENSED} ORDER BY timestamp DESC LIMIT 1",
+)
+
+
+def seed(db, rows):
+    db.executemany(
+        "INSERT INTO pets (name, rfid_uid) VALUES (?, ?)",
+        [(f"pet{i}", f"UID{i:04d}") for i in range(PETS)]
+    )
+    start = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / rows
+    batch = []
+    for i in range(rows):
+        pet_id = random.randint(1, PETS)
+        event = "Dispensed" if random.random() < 0.3 else "Denied"
+        batch.append((pet_id, f"pet{pet_id}", event, "", (start + step * i).strftime(TIMESTAMP_FORMAT)))
+        if len(batch) == 50000:
+            db.executemany(
+                "INSERT INTO feeding_logs (pet_id, pet_name, event_type, details, timestamp) VALUES (?, ?, ?, ?, ?)",
+                batch
+            )
+            batch = []
+    if batch:
+        db.executemany(
+            "INSERT INTO feeding_logs (pet_id, pet_name, event_type, details, timestamp) VALUES (?, ?, ?, ?, ?)",
+            batch
+        )
+    db.commit()
+
+
+def time_scan_queries(db, iterations, queries, today_start):
+    count_today, last_feed = queries
+    samples = []
+    for _ in range(iterations):
+        pet_id = random.randint(1, PETS)
+        started = time.perf_counter()
+        db.execute("SELECT * FROM pets WHERE rfid_uid = ?", (f"UID{pet_id - 1:04d}",)).fetchone()
+        db.execute(count_today, (pet_id, today_start)).fetchone()
+        db.execute(last_feed, (pet_id,)).fetchone()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} | {'before p50':>11} {'before p99':>11} | {'after p50':>10} {'after p99':>10}")
+    for rows in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = sqlite3.connect(os.path.join(tmp, "pets.db"))
+            migrate(db, target=2)
+            seed(db, rows)
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            before = time_scan_queries(db, args.iterations, LEGACY_QUERIES, today.strftime('%Y-%m-%d %H:%M:%S'))
+            migrate(db)
+            after = time_scan_queries(db, args.iterations, COMPACT_QUERIES, day_start_ms(today))
+            db.close()
+        print(f"{rows:>10} | {before[0] * 1000:>9.3f}ms {before[1] * 1000:>9.3f}ms | "
+              f"{after[0] * 1000:>8.3f}ms {after[1] * 1000:>8.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Scan latency and server CPU of JSON /tag against /tag/lean.
+
+Starts server.py (or asgi.py) on a seeded temporary database and plays one
+feeder scanning tags back to back, four ways: JSON or the lean protocol,
+each with a new connection per scan (what the firmware did) and with one
+kept-alive connection. Reports p50/p99 round trip and the server process'
+CPU time per scan, read from /proc (Linux only).
+
+    python bench/bench_lean.py --scans 2000
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from loadgen import free_port, percentile, seed, start_server
+
+MODES = (
+    ("json, new connection", False, False),
+    ("json, keep-alive", False, True),
+    ("lean, new connection", True, False),
+    ("lean, keep-alive", True, True),
+)
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime, fields 14 and 15 of the full line.
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def scan(connection, uid, feeder, lean):
+    if lean:
+        connection.request("POST", f"/tag/lean?feeder={feeder}", body=uid.encode("ascii"),
+                           headers={"Content-Type": "application/octet-stream"})
+    else:
+        connection.request("POST", "/tag", body=json.dumps({"uid": uid, "feeder": feeder}),
+                           headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def run(port, uids, scans, lean, keep_alive, offset):
+    samples = []
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        for i in range(scans):
+            # A fresh feeder id per scan keeps the debounce cache out of the way.
+            feeder = f"bench{offset + i}"
+            started = time.perf_counter()
+            if not keep_alive:
+                connection.close()
+            scan(connection, uids[i % len(uids)], feeder, lean)
+            samples.append(time.perf_counter() - started)
+    finally:
+        connection.close()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scans", type=int, default=2000)
+    parser.add_argument("--pets", type=int, default=30)
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "pets.db")
+        uids, _ = seed(db_path, args.pets, 1)
+        mixed = [uid for group in zip(*uids.values()) for uid in group] + ["NOTAPET"]
+        port = free_port()
+        process = start_server(args.server, db_path, port)
+        try:
+            # Warm up caches and the log writer before measuring.
+            run(port, mixed, 200, False, True, 0)
+            print(f"{'mode':<24} {'p50 ms':>8} {'p99 ms':>8} {'cpu ms/scan':>12}")
+            for index, (label, lean, keep_alive) in enumerate(MODES, 1):
+                cpu = cpu_seconds(process.pid)
+                samples = run(port, mixed, args.scans, lean, keep_alive, index * args.scans)
+                cpu = cpu_seconds(process.pid) - cpu
+                print(f"{label:<24} {percentile(samples, 0.5) * 1000:>8.2f} {percentile(samples, 0.99) * 1000:>8.2f} "
+                      f"{cpu / args.scans * 1000:>12.3f}")
+        finally:
+            process.terminate()
+            process.wait(10)
+
+
+if __name__ == "__main__":
+    main()
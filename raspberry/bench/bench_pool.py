@@ -0,0 +1,120 @@
+"""Request throughput with concurrent readers and writers: connect-per-request
+in rollback-journal mode vs. the pooled WAL connection layer.
+
+Readers run the /api/logs query, writers run the per-scan lookup + insert.
+
+    python bench/bench_pool.py --readers 4 --writers 4 --seconds 5
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logformat import DENIED_OTHER, to_epoch_ms
+from migrations import migrate
+from pool import ConnectionPool
+
+READ_LOGS = "SELECT pet_id, event, value, note, timestamp FROM feeding_logs ORDER BY timestamp DESC LIMIT 100"
+INSERT_LOG = "INSERT INTO feeding_logs (pet_id, event, value, note, timestamp) VALUES (?, ?, ?, ?, ?)"
+
+
+class ConnectPerRequest:
+    def __init__(self, path):
+        self.path = path
+
+    def acquire(self):
+        db = sqlite3.connect(self.path, timeout=5)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def release(self, db):
+        db.close()
+
+
+def reader(source, stop, counts, index):
+    while not stop.is_set():
+        db = source.acquire()
+        try:
+            db.execute(READ_LOGS).fetchall()
+        finally:
+            source.release(db)
+        counts[index] += 1
+
+
+def writer(source, stop, counts, index):
+    while not stop.is_set():
+        db = source.acquire()
+        try:
+            db.execute("SELECT * FROM pets WHERE rfid_uid = ?", ("UID0001",)).fetchone()
+            db.execute(INSERT_LOG, (1, DENIED_OTHER, None, "bench", to_epoch_ms(datetime.now())))
+            db.commit()
+        except sqlite3.OperationalError:
+            counts["busy"] += 1
+            continue
+        finally:
+            source.release(db)
+        counts[index] += 1
+
+
+def run(source, readers, writers, seconds):
+    stop = threading.Event()
+    counts = {"busy": 0}
+    threads = []
+    for i in range(readers):
+        counts[i] = 0
+        threads.append(threading.Thread(target=reader, args=(source, stop, counts, i)))
+    for i in range(readers, readers + writers):
+        counts[i] = 0
+        threads.append(threading.Thread(target=writer, args=(source, stop, counts, i)))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    reads = sum(counts[i] for i in range(readers))
+    writes = sum(counts[i] for i in range(readers, readers + writers))
+    return reads / seconds, writes / seconds, counts["busy"]
+
+
+def prepare(path, journal_mode):
+    db = sqlite3.connect(path)
+    db.execute(f"PRAGMA journal_mode = {journal_mode}")
+    migrate(db)
+    db.execute("INSERT INTO pets (name, rfid_uid) VALUES ('pet1', 'UID0001')")
+    db.executemany(INSERT_LOG, [(1, DENIED_OTHER, None, "seed", to_epoch_ms(datetime.now()))] * 5000)
+    db.commit()
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "baseline.db")
+        prepare(path, "DELETE")
+        baseline = run(ConnectPerRequest(path), args.readers, args.writers, args.seconds)
+
+        path = os.path.join(tmp, "pooled.db")
+        prepare(path, "WAL")
+        pool = ConnectionPool(path, size=args.readers + args.writers)
+        pooled = run(pool, args.readers, args.writers, args.seconds)
+        pool.close_all()
+
+    print(f"{'mode':<24} {'reads/s':>10} {'writes/s':>10} {'busy errors':>12}")
+    print(f"{'connect-per-request':<24} {baseline[0]:>10.0f} {baseline[1]:>10.0f} {baseline[2]:>12}")
+    print(f"{'pool + WAL':<24} {pooled[0]:>10.0f} {pooled[1]:>10.0f} {pooled[2]:>12}")
+
+
+if __name__ == "__main__":
+    main()
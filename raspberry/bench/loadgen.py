@@ -0,0 +1,265 @@
+"""Synthetic feeder fleet against a throwaway server.
+
+Seeds a temporary database with pets and months of feeding_logs, starts
+server.py (or asgi.py) on it, and drives a scan mix from many simulated
+feeders plus dashboards polling /api/logs. Reports throughput and p50/p99
+latency per endpoint and scenario.
+
+    python bench/loadgen.py --pets 50 --months 6 --feeders 20 --duration 30
+    python bench/loadgen.py --mix authorized=1 --max-p99-ms 50   # fails on regression
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(HERE, "..")
+sys.path.insert(0, SERVER_DIR)
+
+from activity import rebuild_groups
+from logformat import DISPENSED, DENIED_DAILY_LIMIT, to_epoch_ms
+from migrations import migrate
+
+SCENARIOS = ("authorized", "cooldown", "daily_limit", "unknown", "registration")
+DEFAULT_MIX = "authorized=40,cooldown=30,daily_limit=10,unknown=15,registration=5"
+EVENTS_PER_PET_DAY = 6
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def seed(path, pets, months):
+    db = sqlite3.connect(path)
+    migrate(db)
+
+    # Every pet is set up so that scanning it always yields one outcome.
+    uids = {"authorized": [], "cooldown": [], "daily_limit": []}
+    rows = []
+    for i in range(pets):
+        kind = ("authorized", "cooldown", "daily_limit")[i % 3]
+        uid = f"{kind[:2].upper()}{i:06d}"
+        cooldown, max_feeds = {"authorized": (0, 10 ** 9), "cooldown": (10 ** 6, 10 ** 9), "daily_limit": (0, 1)}[kind]
+        rows.append((f"pet{i}", uid, 5, cooldown, max_feeds))
+        uids[kind].append(uid)
+    db.executemany(
+        "INSERT INTO pets (name, rfid_uid, portion_size, cooldown_min, max_daily_feeds) VALUES (?, ?, ?, ?, ?)", rows
+    )
+
+    now = datetime.now()
+    start = now - timedelta(days=30 * months)
+    events = int(pets * 30 * months * EVENTS_PER_PET_DAY)
+    step = (now - timedelta(hours=1) - start) / max(events, 1)
+    batch = []
+    for i in range(events):
+        pet_id = random.randint(1, pets)
+        if random.random() < 0.5:
+            batch.append((pet_id, DISPENSED, 5, to_epoch_ms(start + step * i)))
+        else:
+            batch.append((pet_id, DENIED_DAILY_LIMIT, None, to_epoch_ms(start + step * i)))
+        if len(batch) == 50000:
+            db.executemany("INSERT INTO feeding_logs (pet_id, event, value, timestamp) VALUES (?, ?, ?, ?)", batch)
+            batch = []
+
+    # A dispense right now puts cooldown and daily-limit pets out of reach.
+    recent = to_epoch_ms(now)
+    for pet_id in range(1, pets + 1):
+        if (pet_id - 1) % 3:
+            batch.append((pet_id, DISPENSED, 5, recent))
+    db.executemany("INSERT INTO feeding_logs (pet_id, event, value, timestamp) VALUES (?, ?, ?, ?)", batch)
+    rebuild_groups(db)
+    db.commit()
+    db.close()
+    return uids, events
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, db_path, port):
+    env = dict(os.environ, PET_FEEDER_DB=db_path, PET_FEEDER_PORT=str(port))
+    if mode == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "server.py"]
+    process = subprocess.Popen(command, cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with code {process.returncode}")
+        try:
+            request("127.0.0.1", port, "GET", "/api/logs")
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit("Server did not come up within 30s")
+
+
+def request(host, port, method, path, body=None):
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        connection.request(method, path, body=None if body is None else json.dumps(body), headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def timed(self, label, host, port, method, path, body=None, expect=None):
+        started = time.perf_counter()
+        try:
+            status = request(host, port, method, path, body)
+        except OSError:
+            status = None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples[label].append(elapsed)
+            if status is None or status >= 500 or (expect and status not in expect):
+                self.errors[label] += 1
+        return status
+
+
+# Status every scan of a scenario must get; anything else counts as an error.
+EXPECTED_STATUS = {"authorized": 200, "cooldown": 403, "daily_limit": 403, "unknown": 403, "registration": 200}
+
+
+def feeder(recorder, host, port, uids, mix, stop, think_time, name):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    count = 0
+    while not stop.is_set():
+        scenario = random.choices(names, weights)[0]
+        expect = {EXPECTED_STATUS[scenario]}
+        # A new feeder id per scan, so every scan is decided rather than
+        # answered from the server's debounce cache.
+        count += 1
+        feeder_id = f"{name}-{count}"
+        if scenario == "registration":
+            recorder.timed("POST /start_registration", host, port, "POST",
+                           f"/start_registration?feeder={feeder_id}", expect={200})
+            uid = f"NEW{random.getrandbits(40):010x}"
+            recorder.timed("POST /tag (registration)", host, port, "POST", "/tag", {"uid": uid, "feeder": feeder_id},
+                           expect=expect)
+            recorder.timed("GET /get_captured_uid", host, port, "GET", f"/get_captured_uid?feeder={feeder_id}",
+                           expect={200})
+        elif scenario == "unknown":
+            recorder.timed("POST /tag (unknown)", host, port, "POST", "/tag",
+                           {"uid": f"XX{random.getrandbits(32):08x}", "feeder": feeder_id}, expect=expect)
+        elif uids[scenario]:
+            recorder.timed(f"POST /tag ({scenario})", host, port, "POST", "/tag",
+                           {"uid": random.choice(uids[scenario]), "feeder": feeder_id}, expect=expect)
+        if think_time:
+            time.sleep(random.uniform(0, think_time * 2))
+
+
+def dashboard(recorder, host, port, stop, interval):
+    while not stop.is_set():
+        recorder.timed("GET /api/logs", host, port, "GET", "/api/logs")
+        stop.wait(interval)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pets", type=int, default=30)
+    parser.add_argument("--months", type=float, default=3)
+    parser.add_argument("--feeders", type=int, default=10)
+    parser.add_argument("--dashboards", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean seconds between scans per feeder")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--max-p99-ms", type=float, help="exit non-zero if any /tag p99 exceeds this")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "pets.db")
+        seeded_at = time.perf_counter()
+        uids, events = seed(db_path, args.pets, args.months)
+        print(f"Seeded {args.pets} pets and {events} log rows in {time.perf_counter() - seeded_at:.1f}s")
+
+        port = free_port()
+        process = start_server(args.server, db_path, port)
+        recorder = Recorder()
+        stop = threading.Event()
+        threads = [threading.Thread(target=feeder,
+                                    args=(recorder, "127.0.0.1", port, uids, mix, stop, args.think_time, f"feeder-{i}"))
+                   for i in range(args.feeders)]
+        threads += [threading.Thread(target=dashboard, args=(recorder, "127.0.0.1", port, stop, 2.0))
+                    for _ in range(args.dashboards)]
+        try:
+            for thread in threads:
+                thread.start()
+            time.sleep(args.duration)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            process.terminate()
+            process.wait(10)
+
+    results = {}
+    print(f"\n{'endpoint':<32} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for label in sorted(recorder.samples):
+        samples = recorder.samples[label]
+        results[label] = {
+            "requests": len(samples),
+            "throughput": len(samples) / args.duration,
+            "p50_ms": percentile(samples, 0.50) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000,
+            "errors": recorder.errors[label],
+        }
+        row = results[label]
+        print(f"{label:<32} {row['requests']:>9} {row['throughput']:>8.1f} {row['p50_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} {row['errors']:>7}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+    if args.max_p99_ms is not None:
+        slow = [label for label, row in results.items()
+                if label.startswith("POST /tag") and row["p99_ms"] > args.max_p99_ms]
+        if slow:
+            print(f"\np99 above {args.max_p99_ms}ms: {', '.join(slow)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Concurrent scans of the same tags across several server processes.
+
+Starts --workers copies of server.py (or asgi.py) on one temporary database
+and has every feeder thread scan the same few tags as fast as it can. Half
+the pets may be fed --max-feeds times a day with no cooldown, the other half
+have a one minute cooldown. Afterwards the Dispensed rows are checked: a pet
+fed more than max_daily_feeds times in a day, or twice within cooldown_min,
+is reported and the script exits non-zero. Before that, a pet is registered
+through one worker and scanned on every other one, which must recognise it.
+
+    python bench/stress_dispense.py --workers 4 --feeders 32 --duration 10
+"""
+import argparse
+import http.client
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlencode
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from loadgen import free_port, request, start_server
+from logformat import DISPENSED, from_epoch_ms
+from migrations import migrate
+
+
+def seed(path, pets, max_feeds):
+    db = sqlite3.connect(path)
+    migrate(db)
+    rows = []
+    for i in range(pets):
+        if i % 2:
+            rows.append((f"cooldown{i}", f"CD{i:06d}", 1, 1, 10 ** 6))
+        else:
+            rows.append((f"limit{i}", f"LI{i:06d}", 1, 0, max_feeds))
+    db.executemany(
+        "INSERT INTO pets (name, rfid_uid, portion_size, cooldown_min, max_daily_feeds) VALUES (?, ?, ?, ?, ?)", rows
+    )
+    db.commit()
+    db.close()
+    return [row[1] for row in rows]
+
+
+def feeder(ports, uids, stop, statuses, lock, name):
+    index = 0
+    while not stop.is_set():
+        port = ports[index % len(ports)]
+        uid = uids[index % len(uids)]
+        index += 1
+        # A new feeder id per scan keeps the debounce cache out of the way,
+        # so every scan is decided.
+        try:
+            status = request("127.0.0.1", port, "POST", "/tag", {"uid": uid, "feeder": f"{name}-{index}"})
+        except OSError:
+            status = None
+        with lock:
+            statuses[status] += 1
+
+
+def register(port, name, uid):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        connection.request("POST", "/register", body=urlencode(
+            {"name": name, "uid": uid, "portion": 1, "cooldown": 0, "max_feeds": 10 ** 6}
+        ), headers={"Content-Type": "application/x-www-form-urlencoded"})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def cross_worker_problems(ports):
+    # Each worker keeps its own eligibility state; a pet added through one
+    # must be fed on all the others without a restart.
+    uid = "XW000001"
+    status = register(ports[0], "crossworker", uid)
+    if status != 200:
+        return [f"registering {uid} on worker 0 returned {status}"]
+    problems = []
+    for index, port in enumerate(ports[1:], 1):
+        status = request("127.0.0.1", port, "POST", "/tag", {"uid": uid, "feeder": f"crossworker{index}"})
+        if status != 200:
+            problems.append(f"{uid} registered on worker 0 was answered {status} by worker {index}")
+    return problems
+
+
+def violations(path):
+    db = sqlite3.connect(path)
+    limits = {pet_id: (name, cooldown_min, max_daily_feeds) for pet_id, name, cooldown_min, max_daily_feeds in
+              db.execute("SELECT id, name, cooldown_min, max_daily_feeds FROM pets")}
+    feeds = defaultdict(list)
+    for pet_id, timestamp in db.execute(
+            "SELECT pet_id, timestamp FROM feeding_logs WHERE event = ? ORDER BY pet_id, timestamp", (DISPENSED,)):
+        feeds[pet_id].append(timestamp)
+    db.close()
+
+    problems = []
+    for pet_id, times in feeds.items():
+        name, cooldown_min, max_daily_feeds = limits[pet_id]
+        for day, count in Counter(from_epoch_ms(when).date() for when in times).items():
+            if count > max_daily_feeds:
+                problems.append(f"{name}: fed {count} times on {day}, limit {max_daily_feeds}")
+        for earlier, later in zip(times, times[1:]):
+            if later - earlier < cooldown_min * 60000:
+                problems.append(f"{name}: fed at {from_epoch_ms(earlier)} and {from_epoch_ms(later)}, "
+                                f"cooldown {cooldown_min}m")
+    return problems, sum(len(times) for times in feeds.values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4, help="server processes sharing the database")
+    parser.add_argument("--feeders", type=int, default=32)
+    parser.add_argument("--pets", type=int, default=4)
+    parser.add_argument("--max-feeds", type=int, default=3)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "pets.db")
+        uids = seed(db_path, args.pets, args.max_feeds)
+
+        ports = [free_port() for _ in range(args.workers)]
+        processes = []
+        statuses = Counter()
+        lock = threading.Lock()
+        stop = threading.Event()
+        threads = [threading.Thread(target=feeder, args=(ports, uids[i % len(uids):] + uids[:i % len(uids)],
+                                                         stop, statuses, lock, f"stress{i}"))
+                   for i in range(args.feeders)]
+        try:
+            for port in ports:
+                processes.append(start_server(args.server, db_path, port))
+            cross_worker = cross_worker_problems(ports)
+            for thread in threads:
+                thread.start()
+            time.sleep(args.duration)
+        finally:
+            stop.set()
+            for thread in threads:
+                if thread.is_alive():
+                    thread.join()
+            for process in processes:
+                process.terminate()
+                process.wait(10)
+
+        problems, dispensed = violations(db_path)
+        problems = cross_worker + problems
+
+    scans = sum(statuses.values())
+    print(f"{scans} scans across {args.workers} workers: " +
+          ", ".join(f"{status}={count}" for status, count in sorted(statuses.items(), key=str)))
+    print(f"{dispensed} dispenses for {args.pets} pets")
+    if problems:
+        print("\n".join(problems))
+        sys.exit(1)
+    print("No pet exceeded max_daily_feeds or cooldown_min")
+
+
+if __name__ == "__main__":
+    main()
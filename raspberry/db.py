@@ -1,11 +1,13 @@
 import sqlite3
+from migrations import migrate, MigrationError
+
 db = sqlite3.connect("pets.db")
-db.execute("""
-CREATE TABLE pets (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL,
-    rfid_uid TEXT UNIQUE NOT NULL
-)
-""")
-db.commit()
+try:
+    version = migrate(db)
+except MigrationError as e:
+    raise SystemExit(f"pets.db was not upgraded: {e}")
+print(f"pets.db is at schema version {version}")
+# Migrations that rewrite tables (like the compact feeding_logs format of
+# version 9) leave the old pages allocated until the file is vacuumed.
+db.execute("VACUUM")
 db.close()
@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class _Burst:
+    __slots__ = ("response", "outcome", "log_key", "expires", "repeats")
+
+    def __init__(self, response, outcome, log_key, expires):
+        self.response = response
+        self.outcome = outcome
+        self.log_key = log_key
+        self.expires = expires
+        self.repeats = 0
+
+
+class ScanDebouncer:
+    """Answers repeated posts of the same tag from the same feeder from memory.
+
+    A tag resting on the reader is re-posted every few hundred milliseconds.
+    The first scan of a (feeder, uid) pair is decided and logged as usual;
+    further scans within `window` seconds of it get the same response back
+    without touching the database and are only counted. Once the window has
+    passed, expired() hands the counts out so they can be added to the
+    logged event in a single write.
+    """
+
+    def __init__(self, window=3.0, sweep_interval=1.0):
+        self.window = window
+        self.sweep_interval = sweep_interval
+        self._bursts = {}
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    def lookup(self, feeder, uid, now=None):
+        """(response, outcome) for a repeat within the window, else None."""
+        now = now or time.monotonic()
+        with self._lock:
+            burst = self._bursts.get((feeder, uid))
+            if burst is None or now >= burst.expires:
+                return None
+            burst.repeats += 1
+            return burst.response, burst.outcome
+
+    def remember(self, feeder, uid, response, outcome, log_key, now=None):
+        """Start a burst for a decided scan.
+
+        log_key is (pet_id, event, note, timestamp) of the logged row, or None
+        to not count the repeats anywhere. Returns the counts of a finished
+        burst this one replaces, like expired().
+        """
+        if self.window <= 0:
+            return []
+        now = now or time.monotonic()
+        with self._lock:
+            previous = self._bursts.get((feeder, uid))
+            self._bursts[(feeder, uid)] = _Burst(response, outcome, log_key, now + self.window)
+        if previous is not None and previous.repeats and previous.log_key:
+            return [previous.log_key + (previous.repeats,)]
+        return []
+
+    def expired(self, now=None):
+        """(pet_id, event, note, timestamp, repeats) of finished bursts with repeats."""
+        now = now or time.monotonic()
+        if now < self._next_sweep:
+            return []
+        with self._lock:
+            self._next_sweep = now + self.sweep_interval
+            done = [key for key, burst in self._bursts.items() if now >= burst.expires]
+            bursts = [self._bursts.pop(key) for key in done]
+        return [burst.log_key + (burst.repeats,) for burst in bursts if burst.repeats and burst.log_key]
+
+    def drain(self):
+        # Every pending count, e.g. at shutdown or before the pets change.
+        with self._lock:
+            bursts, self._bursts = list(self._bursts.values()), {}
+        return [burst.log_key + (burst.repeats,) for burst in bursts if burst.repeats and burst.log_key]
@@ -0,0 +1,233 @@
+import threading
+from datetime import datetime, timedelta
+
+from logformat import DISPENSED, to_epoch_ms, day_start_ms
+
+AUTHORIZED = "authorized"
+DAILY_LIMIT = "daily_limit"
+COOLDOWN = "cooldown"
+UNKNOWN = "unknown"
+
+# Column defaults of pets, used for settings stored as NULL by older versions.
+SETTING_DEFAULTS = {"portion_size": 5, "cooldown_min": 60, "max_daily_feeds": 3}
+
+
+class PetState:
+    __slots__ = ("id", "name", "rfid_uid", "portion_size", "cooldown_min",
+                 "max_daily_feeds", "day", "fed_today", "last_feed", "remaining", "eligible_at")
+
+    # last_feed and eligible_at are in epoch milliseconds, like
+    # feeding_logs.timestamp. remaining and eligible_at are derived from the
+    # counters by settle() whenever those change.
+    def __init__(self, row):
+        self.id = row["id"]
+        self.name = row["name"]
+        self.rfid_uid = row["rfid_uid"]
+        for setting, default in SETTING_DEFAULTS.items():
+            setattr(self, setting, default if row[setting] is None else row[setting])
+        self.day = None
+        self.fed_today = 0
+        self.last_feed = None
+        self.settle()
+
+    def roll_over(self, now):
+        today = now.date()
+        if self.day != today:
+            self.day = today
+            self.fed_today = 0
+            self.settle()
+
+    def settle(self):
+        # Feeds left today and the earliest time a scan can be authorized,
+        # None when that is already the case: the end of the cooldown, or
+        # the next midnight once the daily quota is used up.
+        self.remaining = max(0, self.max_daily_feeds - self.fed_today)
+        eligible_at = self.last_feed + self.cooldown_min * 60000 if self.last_feed is not None else None
+        if self.remaining == 0 and self.day is not None:
+            tomorrow = to_epoch_ms(datetime.combine(self.day + timedelta(days=1), datetime.min.time()))
+            eligible_at = max(eligible_at or 0, tomorrow)
+        self.eligible_at = eligible_at
+
+
+class Decision:
+    __slots__ = ("status", "pet", "wait_min")
+
+    def __init__(self, status, pet=None, wait_min=None):
+        self.status = status
+        self.pet = pet
+        self.wait_min = wait_min
+
+
+def load_pet(db, pet_id):
+    row = db.execute("SELECT * FROM pets WHERE id = ?", (pet_id,)).fetchone()
+    return PetState(row) if row else None
+
+
+def find_pet(db, uid):
+    row = db.execute("SELECT * FROM pets WHERE rfid_uid = ?", (uid,)).fetchone()
+    return PetState(row) if row else None
+
+
+def pets_generation(db):
+    row = db.execute("SELECT value FROM log_meta WHERE key = 'pets_generation'").fetchone()
+    return row[0] if row else 0
+
+
+def check_history(db, pet, when):
+    """Decide a scan at an arbitrary time from the durable log.
+
+    Used for replayed scans, where the in-memory state (which only knows
+    about today and the latest dispense) does not apply, and to confirm
+    live scans inside the dispensing transaction. A scan is only
+    authorized if it keeps the whole day within max_daily_feeds and stays
+    cooldown_min away from dispenses on either side of it.
+    """
+    day_start = when.replace(hour=0, minute=0, second=0, microsecond=0)
+    stamp = to_epoch_ms(when)
+
+    fed = db.execute(
+        "SELECT COUNT(*) FROM feeding_logs WHERE pet_id = ? AND event = ? AND timestamp >= ? AND timestamp < ?",
+        (pet.id, DISPENSED, to_epoch_ms(day_start), to_epoch_ms(day_start + timedelta(days=1)))
+    ).fetchone()[0]
+    if fed >= pet.max_daily_feeds:
+        return Decision(DAILY_LIMIT, pet)
+
+    before = db.execute(
+        "SELECT MAX(timestamp) FROM feeding_logs WHERE pet_id = ? AND event = ? AND timestamp <= ?",
+        (pet.id, DISPENSED, stamp)
+    ).fetchone()[0]
+    after = db.execute(
+        "SELECT MIN(timestamp) FROM feeding_logs WHERE pet_id = ? AND event = ? AND timestamp > ?",
+        (pet.id, DISPENSED, stamp)
+    ).fetchone()[0]
+
+    cooldown_ms = pet.cooldown_min * 60000
+    for neighbour in (before, after):
+        if neighbour is None:
+            continue
+        apart_ms = abs(stamp - neighbour)
+        if apart_ms < cooldown_ms:
+            return Decision(COOLDOWN, pet, (cooldown_ms - apart_ms) // 60000)
+
+    return Decision(AUTHORIZED, pet)
+
+
+def feed_counters(db, pet_id, now):
+    """(feeds since midnight, last feed in epoch ms or None) for one pet."""
+    return db.execute("""
+        SELECT (SELECT COUNT(*) FROM feeding_logs
+                WHERE pet_id = :pet_id AND event = :dispensed AND timestamp >= :today),
+               (SELECT MAX(timestamp) FROM feeding_logs
+                WHERE pet_id = :pet_id AND event = :dispensed)
+    """, {"pet_id": pet_id, "dispensed": DISPENSED, "today": day_start_ms(now)}).fetchone()
+
+
+class EligibilityEngine:
+    """In-memory view of who may be fed right now.
+
+    The database stays the durable record; this is rebuilt from it with
+    warm() and kept current through record() as events are logged.
+    `version` changes whenever a pet's counters or settings may have.
+    Changes made by other processes are picked up through stale(), which
+    compares the pets_generation this state was built from.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_uid = {}
+        self._by_id = {}
+        self.ready = False
+        self.version = 0
+        self.generation = None
+
+    def stale(self, db):
+        return not self.ready or pets_generation(db) != self.generation
+
+    def warm(self, db, now=None):
+        now = now or datetime.now()
+        # Read first: a change committed while warming shows up as stale.
+        generation = pets_generation(db)
+
+        pets = {}
+        for row in db.execute("SELECT * FROM pets").fetchall():
+            state = PetState(row)
+            state.day = now.date()
+            pets[state.id] = state
+
+        # One index seek per pet; a GROUP BY over feeding_logs walks the
+        # whole index, and warm() also runs inside requests.
+        for state in pets.values():
+            state.fed_today, state.last_feed = feed_counters(db, state.id, now)
+
+        for state in pets.values():
+            state.settle()
+        with self._lock:
+            self._by_id = pets
+            self._by_uid = {state.rfid_uid: state for state in pets.values()}
+            self.ready = True
+            self.generation = generation
+            self.version += 1
+
+    def refresh(self, db, pet_id, now=None):
+        """Reload one pet's counters after another process fed it."""
+        now = now or datetime.now()
+        fed_today, last_feed = feed_counters(db, pet_id, now)
+        with self._lock:
+            pet = self._by_id.get(pet_id)
+            if pet is None:
+                return
+            pet.day = now.date()
+            pet.fed_today = fed_today
+            pet.last_feed = last_feed
+            pet.settle()
+            self.version += 1
+
+    def check(self, uid, now=None):
+        now = now or datetime.now()
+        with self._lock:
+            pet = self._by_uid.get(uid)
+            if pet is None:
+                return Decision(UNKNOWN)
+
+            pet.roll_over(now)
+            if pet.remaining == 0:
+                return Decision(DAILY_LIMIT, pet)
+
+            if pet.eligible_at is not None:
+                wait_ms = pet.eligible_at - to_epoch_ms(now)
+                if wait_ms > 0:
+                    return Decision(COOLDOWN, pet, wait_ms // 60000)
+
+            return Decision(AUTHORIZED, pet)
+
+    def record(self, pet_id, event, when):
+        if event != DISPENSED:
+            return
+        stamp = to_epoch_ms(when)
+        with self._lock:
+            pet = self._by_id.get(pet_id)
+            if pet is None:
+                return
+            pet.roll_over(when)
+            pet.fed_today += 1
+            if pet.last_feed is None or stamp > pet.last_feed:
+                pet.last_feed = stamp
+            pet.settle()
+            self.version += 1
+
+    def hints(self, now=None):
+        """(version, [(rfid_uid, pet_id, remaining, eligible_at), ...]) for every pet.
+
+        Pets are rolled over to `now` first, so after midnight the quota is
+        back and only a cooldown carried over from yesterday remains.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            for pet in self._by_id.values():
+                pet.roll_over(now)
+            return self.version, [(pet.rfid_uid, pet.id, pet.remaining, pet.eligible_at)
+                                  for pet in self._by_id.values()]
+
+    def lookup(self, uid):
+        with self._lock:
+            return self._by_uid.get(uid)
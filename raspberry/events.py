@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import deque
+
+
+class EventBus:
+    """Fan-out of logged events to any number of waiting stream clients.
+
+    Events are kept in one shared, bounded history and numbered by the bus
+    itself, since not every event is a new log row. Each client only
+    remembers a cursor (generation, last id sent), so publishing is O(1) no
+    matter how many dashboards are connected, and a reconnecting client can
+    resume from its Last-Event-ID while that id is still in the history.
+    """
+
+    def __init__(self, history=512):
+        self._history = deque()
+        self._limit = history
+        self._dropped_through = None
+        self._generation = 0
+        # Starting from the clock keeps a Last-Event-ID from before a restart
+        # from matching an event of this process.
+        self._last_id = time.time_ns() // 1000000
+        self._changed = threading.Condition()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        # Called after every publish or reset, for waiters that cannot block
+        # on the condition (the asyncio server).
+        self._listeners.append(callback)
+
+    def publish(self, name, data):
+        with self._changed:
+            self._last_id += 1
+            self._history.append((self._last_id, name, data))
+            if len(self._history) > self._limit:
+                self._dropped_through = self._history.popleft()[0]
+            self._changed.notify_all()
+        self._notify_listeners()
+
+    def reset(self):
+        # Clients drop what they have and reload, e.g. after logs were
+        # cleared or a pet and its history were deleted.
+        with self._changed:
+            self._history.clear()
+            self._dropped_through = None
+            self._generation += 1
+            self._changed.notify_all()
+        self._notify_listeners()
+
+    def cursor(self, last_id=None):
+        """Cursor for a new client, or None if last_id cannot be resumed."""
+        with self._changed:
+            if last_id is None:
+                return self._head()
+            if any(event[0] == last_id for event in self._history):
+                return self._generation, last_id
+            return None
+
+    def wait(self, cursor, timeout):
+        """Return (events, cursor) for events published after cursor.
+
+        Blocks for up to timeout seconds while there is nothing new, in which
+        case events is empty. cursor is None when the client fell behind the
+        history or missed a reset and has to reload.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._head() != cursor, timeout)
+
+            generation, last_id = cursor
+            if generation != self._generation:
+                return [], None
+            if last_id is None:
+                events = list(self._history)
+            else:
+                if self._dropped_through is not None and last_id <= self._dropped_through:
+                    return [], None
+                events = [event for event in self._history if event[0] > last_id]
+            return events, self._head()
+
+    def _notify_listeners(self):
+        for callback in self._listeners:
+            callback()
+
+    def _head(self):
+        last_id = self._history[-1][0] if self._history else None
+        return self._generation, last_id
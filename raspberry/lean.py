@@ -0,0 +1,50 @@
+# Fixed-format scan protocol for feeders: the request body is the tag UID as
+# plain ASCII, the response body is two bytes, an outcome code and the
+# portion in seconds (0 unless authorized). No JSON on either side.
+CONTENT_TYPE = "application/octet-stream"
+
+AUTHORIZED = 0
+DAILY_LIMIT = 1
+COOLDOWN = 2
+UNKNOWN = 3
+ALREADY_DISPENSED = 4
+REGISTERED = 5
+ALREADY_REGISTERED = 6
+ERROR = 255
+
+# (JSON status, message) of handle_scan() responses and their outcome code.
+CODES = {
+    ("denied", "Daily limit reached"): DAILY_LIMIT,
+    ("denied", "Diet active"): COOLDOWN,
+    ("denied", "Pet not recognized"): UNKNOWN,
+    ("denied", "Already dispensed"): ALREADY_DISPENSED,
+    ("registration", "Tag captured"): REGISTERED,
+    ("error", "Tag already registered"): ALREADY_REGISTERED,
+}
+
+
+def decode_uid(body):
+    return body.decode("ascii", errors="replace").strip() if body else ""
+
+
+def encode_response(body):
+    if body.get("status") == "authorized":
+        return bytes((AUTHORIZED, max(0, min(int(body.get("portion_time") or 0), 255))))
+    return bytes((CODES.get((body.get("status"), body.get("message")), ERROR), 0))
+
+
+def encode_hints(pets):
+    """/api/eligibility?format=lean: one record per pet, for feeders without a JSON parser.
+
+    Each record is the UID length (1 byte), the UID in ASCII, the feeds left
+    today (1 byte, capped at 255) and the seconds until the pet may be fed
+    again (4 bytes, big-endian, 0 if it may be fed now).
+    """
+    out = bytearray()
+    for pet in pets:
+        uid = pet["rfid_uid"].encode("ascii", errors="replace")[:255]
+        out.append(len(uid))
+        out += uid
+        out.append(min(pet["remaining"], 255))
+        out += min(pet["wait_s"], 0xFFFFFFFF).to_bytes(4, "big")
+    return bytes(out)
@@ -0,0 +1,187 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from activity import add_repeats, append_logs
+from metrics import LOG_BATCH_ROWS, LOG_DROPPED
+
+_STOP = object()
+
+
+class _Repeats(tuple):
+    # (pet_id, event, note, timestamp, repeats) for activity.add_repeats().
+    pass
+
+
+class LogWriter:
+    """Queues feeding_logs rows and commits them in batches on a background thread.
+
+    A batch is written once max_batch rows are waiting or max_delay seconds
+    after its first row, whichever comes first, so a burst of scans costs
+    one commit instead of one per scan. Debounced repeat counts ride along
+    in the same transactions; on_repeats gets {group_id: count} for the
+    groups they changed. on_commit and on_repeats run under commit_lock
+    together with the commit, so callers that share the lock publish
+    events in commit order. A batch that still fails after a few attempts
+    is dropped and counted in log_writer_dropped_total; the writer itself
+    keeps running.
+    """
+
+    def __init__(self, connect, max_batch=64, max_delay=0.25, max_queue=10000, put_timeout=5.0,
+                 flush_timeout=10.0, on_commit=None, on_repeats=None, commit_lock=None):
+        self.connect = connect
+        self.on_commit = on_commit
+        self.commit_lock = commit_lock or threading.Lock()
+        self.on_repeats = on_repeats
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.flush_timeout = flush_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, pet_id, pet_name, event, value, note, timestamp):
+        self.start()
+        # Blocks while the queue is full; raises queue.Full if the writer
+        # cannot keep up within put_timeout.
+        self._queue.put((pet_id, pet_name, event, value, note, timestamp), timeout=self.put_timeout)
+
+    def submit_repeats(self, items):
+        if not items:
+            return
+        self.start()
+        # Never blocks: it runs after a dispense has been committed, and a
+        # lost repeat count only makes a group's counter a little low.
+        for index, item in enumerate(items):
+            try:
+                self._queue.put_nowait(_Repeats(item))
+            except queue.Full:
+                self._drop([], items[index:], "queue full")
+                return
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far has been written or dropped.
+
+        Gives up after `timeout` seconds (flush_timeout by default) and
+        returns False, so a stuck database cannot hang the caller.
+        """
+        if self._thread is None:
+            return True
+        self.start()
+        done = threading.Event()
+        timeout = self.flush_timeout if timeout is None else timeout
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        if not done.wait(timeout):
+            print(f"Log writer: flush timed out after {timeout}s")
+            return False
+        return True
+
+    def close(self, timeout=10.0):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        db = None
+        try:
+            stopping = False
+            while not stopping:
+                rows, repeats, waiters, stopping = self._collect(self._queue.get())
+                try:
+                    if rows or repeats:
+                        db = self._write(db, rows, repeats)
+                except Exception as e:
+                    self._drop(rows, repeats, repr(e))
+                finally:
+                    for waiter in waiters:
+                        waiter.set()
+        finally:
+            if db is not None:
+                db.close()
+
+    def _collect(self, first):
+        rows, repeats, waiters = [], [], []
+        item = first
+        deadline = time.monotonic() + self.max_delay
+        while True:
+            if item is _STOP:
+                return rows, repeats, waiters, True
+            if isinstance(item, threading.Event):
+                # A flush request ends the batch early.
+                waiters.append(item)
+                return rows, repeats, waiters, False
+            if isinstance(item, _Repeats):
+                repeats.append(item)
+            else:
+                rows.append(item)
+            if len(rows) + len(repeats) >= self.max_batch:
+                return rows, repeats, waiters, False
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return rows, repeats, waiters, False
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return rows, repeats, waiters, False
+
+    def _write(self, db, rows, repeats, attempts=3):
+        # Returns the connection to use next; it is replaced after an error,
+        # since it may be what failed.
+        for attempt in range(attempts):
+            try:
+                if db is None:
+                    db = self.connect()
+                db.execute("BEGIN IMMEDIATE")
+                try:
+                    # Rows first: repeats may refer to a row of this batch.
+                    results = append_logs(db, rows) if rows else []
+                    counts = add_repeats(db, repeats) if repeats else {}
+                    with self.commit_lock:
+                        db.commit()
+                        if results and self.on_commit:
+                            self._notify(self.on_commit, [result + (row,) for result, row in zip(results, rows)])
+                        if counts and self.on_repeats:
+                            self._notify(self.on_repeats, counts)
+                except BaseException:
+                    db.rollback()
+                    raise
+                if rows:
+                    LOG_BATCH_ROWS.observe(len(rows))
+                return db
+            except sqlite3.Error as e:
+                print(f"Log writer: batch of {len(rows)} failed ({e}), attempt {attempt + 1}/{attempts}")
+                if not isinstance(e, sqlite3.OperationalError) and db is not None:
+                    db.close()
+                    db = None
+                time.sleep(0.1 * (attempt + 1))
+        self._drop(rows, repeats, f"{attempts} failed attempts")
+        return db
+
+    def _drop(self, rows, repeats, reason):
+        print(f"Log writer: dropped {len(rows)} log rows and {len(repeats)} repeat counts ({reason})")
+        if rows:
+            LOG_DROPPED.inc("rows", amount=len(rows))
+        if repeats:
+            LOG_DROPPED.inc("repeats", amount=len(repeats))
+
+    def _notify(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"Log writer: commit callback failed: {e}")
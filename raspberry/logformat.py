@@ -0,0 +1,88 @@
+import re
+from datetime import datetime
+
+# Format of timestamps in API responses, archives and pre-migration rows.
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# feeding_logs.event codes. `value` holds the portion in seconds for
+# DISPENSED and the minutes left for DENIED_COOLDOWN; `note` holds the tag
+# of DENIED_UNKNOWN. DENIED_OTHER only comes from migrated rows whose
+# details did not match any known message, which are kept in `note`.
+DISPENSED = 1
+DENIED_DAILY_LIMIT = 2
+DENIED_COOLDOWN = 3
+DENIED_UNKNOWN = 4
+DENIED_OTHER = 5
+
+PORTION = re.compile(r"(\d+)s portion$")
+COOLDOWN_LEFT = re.compile(r"Cooldown active \((-?\d+)m left\)$")
+UNKNOWN_TAG = "Unknown Tag: "
+
+
+def to_epoch_ms(when):
+    # Local wall-clock time, like the datetime.now() values it replaces.
+    return int(when.timestamp()) * 1000 + when.microsecond // 1000
+
+
+def from_epoch_ms(ms):
+    return datetime.fromtimestamp(ms // 1000).replace(microsecond=ms % 1000 * 1000)
+
+
+def day_start_ms(when):
+    return to_epoch_ms(when.replace(hour=0, minute=0, second=0, microsecond=0))
+
+
+def format_timestamp(ms):
+    return from_epoch_ms(ms).strftime(TIMESTAMP_FORMAT)
+
+
+def describe_event(event, value, note):
+    """The (event_type, details) strings the API has always returned."""
+    if event == DISPENSED:
+        return "Dispensed", f"{value}s portion" if value is not None else (note or "")
+    if event == DENIED_DAILY_LIMIT:
+        return "Denied", "Daily limit reached"
+    if event == DENIED_COOLDOWN:
+        return "Denied", f"Cooldown active ({value}m left)"
+    if event == DENIED_UNKNOWN:
+        return "Denied", f"{UNKNOWN_TAG}{note or ''}"
+    return "Denied", note or ""
+
+
+def format_entry(pet_name, event, value, note, timestamp):
+    event_type, details = describe_event(event, value, note)
+    return {
+        "pet_name": pet_name or "Unknown",
+        "event_type": event_type,
+        "details": details,
+        "timestamp": format_timestamp(timestamp),
+    }
+
+
+def encode_legacy(event_type, details):
+    """(event, value, note) for a pre-migration event_type/details pair."""
+    details = details or ""
+    if event_type == "Dispensed":
+        portion = PORTION.match(details)
+        if portion:
+            return DISPENSED, int(portion.group(1)), None
+        return DISPENSED, None, details or None
+    if details == "Daily limit reached":
+        return DENIED_DAILY_LIMIT, None, None
+    cooldown = COOLDOWN_LEFT.match(details)
+    if cooldown:
+        return DENIED_COOLDOWN, int(cooldown.group(1)), None
+    if details.startswith(UNKNOWN_TAG):
+        return DENIED_UNKNOWN, None, details[len(UNKNOWN_TAG):]
+    return DENIED_OTHER, None, details or None
+
+
+def parse_legacy_timestamp(value):
+    # Rows written by log_event carry microseconds, rows defaulted by
+    # CURRENT_TIMESTAMP do not.
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+    except ValueError:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
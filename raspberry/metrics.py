@@ -0,0 +1,197 @@
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    # Read at scrape time from a callback, e.g. a queue length.
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(self.read())}"]
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for label_values, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "Request handling time by route.", ["method", "route", "status"]))
+DECISIONS = registry.register(Counter(
+    "feeding_decisions_total", "Scan decisions by outcome.", ["source", "outcome"]))
+QUERY_SECONDS = registry.register(Histogram(
+    "sqlite_query_duration_seconds", "Time spent in SQLite execute() by statement.", ["statement"]))
+COMMIT_SECONDS = registry.register(Histogram(
+    "sqlite_commit_duration_seconds", "Time spent committing (including fsync).", ["connection"]))
+LOG_BATCH_ROWS = registry.register(Histogram(
+    "log_writer_batch_rows", "Rows written per log writer transaction.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)))
+LOG_DROPPED = registry.register(Counter(
+    "log_writer_dropped_total", "Log rows and repeat counts given up after failed writes.", ["kind"]))
+
+# Schema and connection setup statements are not queries worth a series.
+UNTIMED_STATEMENTS = ("CREATE", "ALTER", "DROP", "PRAGMA", "VACUUM")
+# Placeholder lists of any length share one label.
+_IN_LIST = re.compile(r"\bIN \(\?(?:\s*,\s*\?)*\)", re.IGNORECASE)
+# Statements beyond this many distinct labels are counted as "other".
+MAX_STATEMENT_LABELS = 200
+MAX_CACHED_STATEMENTS = 1000
+
+_statement_labels = {}
+_labels = set()
+
+
+def _normalize(sql):
+    text = " ".join(sql.split())
+    if text.upper().startswith(UNTIMED_STATEMENTS):
+        return None
+    return _IN_LIST.sub("IN (?, ...)", text)[:100]
+
+
+def statement_label(sql):
+    """Label for a statement's latency series, or None to leave it untimed."""
+    # Most SQL strings are constants, so the label is cached per string.
+    try:
+        return _statement_labels[sql]
+    except KeyError:
+        pass
+    label = _normalize(sql)
+    if label is not None and label not in _labels:
+        if len(_labels) < MAX_STATEMENT_LABELS:
+            _labels.add(label)
+        else:
+            label = "other"
+    if len(_statement_labels) < MAX_CACHED_STATEMENTS:
+        _statement_labels[sql] = label
+    return label
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3.Connection that records execute and commit times.
+
+    Statements run while `timed` is False, such as migrations, are not
+    recorded.
+    """
+
+    role = "request"
+    timed = True
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._observe(sql, started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self._observe(sql, started)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            COMMIT_SECONDS.observe(time.perf_counter() - started, self.role)
+
+    def _observe(self, sql, started):
+        label = statement_label(sql) if self.timed else None
+        if label is not None:
+            QUERY_SECONDS.observe(time.perf_counter() - started, label)
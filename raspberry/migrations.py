@@ -0,0 +1,336 @@
+from datetime import datetime
+
+from activity import rebuild_groups
+from logformat import encode_legacy, parse_legacy_timestamp, to_epoch_ms
+
+
+class MigrationError(Exception):
+    """A migration cannot be applied to the data as it is; nothing was changed."""
+
+
+def _initial_schema(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS pets (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            rfid_uid TEXT,
+            portion_size INTEGER DEFAULT 5,
+            cooldown_min INTEGER DEFAULT 60,
+            max_daily_feeds INTEGER DEFAULT 3
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS feeding_logs (
+            id INTEGER PRIMARY KEY,
+            pet_id INTEGER,
+            pet_name TEXT,
+            event_type TEXT,
+            details TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(pet_id) REFERENCES pets(id)
+        )
+    """)
+
+
+def _reconcile_pets(db):
+    # Databases created by the old db.py only have id, name and rfid_uid.
+    columns = {row[1] for row in db.execute("PRAGMA table_info(pets)")}
+    for column, default in (("portion_size", 5), ("cooldown_min", 60), ("max_daily_feeds", 3)):
+        if column not in columns:
+            db.execute(f"ALTER TABLE pets ADD COLUMN {column} INTEGER DEFAULT {default}")
+
+
+def _add_indexes(db):
+    # The old /register never checked for duplicates. Which pet should keep
+    # a shared tag is not ours to guess (logs refer to both ids), so stop
+    # and let the owner delete or re-tag one of them.
+    duplicates = db.execute("""
+        SELECT rfid_uid, GROUP_CONCAT(id, ', ') FROM pets
+        WHERE rfid_uid IS NOT NULL GROUP BY rfid_uid HAVING COUNT(*) > 1 ORDER BY rfid_uid
+    """).fetchall()
+    if duplicates:
+        raise MigrationError(
+            "pets.rfid_uid must be unique, but these tags belong to several pets: "
+            + "; ".join(f"{uid!r} (pet ids {ids})" for uid, ids in duplicates)
+            + ". Delete or re-tag all but one pet per tag, then start again."
+        )
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_pets_rfid_uid ON pets(rfid_uid)")
+    # Covers the daily-limit count and the last-dispense lookup.
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_feeding_logs_pet_event_time
+        ON feeding_logs(pet_id, event_type, timestamp)
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_feeding_logs_timestamp ON feeding_logs(timestamp)")
+
+
+def _add_log_meta(db):
+    # generation is bumped whenever log rows are deleted, so clients can
+    # tell a cleared history apart from one that simply has not moved.
+    db.execute("CREATE TABLE IF NOT EXISTS log_meta (key TEXT PRIMARY KEY, value INTEGER)")
+    db.execute("INSERT OR IGNORE INTO log_meta (key, value) VALUES ('generation', 0)")
+
+
+def _add_log_groups(db):
+    # Run-length grouped view of feeding_logs, maintained by append_logs().
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS log_groups (
+            id INTEGER PRIMARY KEY,
+            pet_id INTEGER,
+            pet_name TEXT,
+            event_type TEXT,
+            details TEXT,
+            timestamp DATETIME,
+            count INTEGER,
+            first_log_id INTEGER,
+            last_log_id INTEGER
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_log_groups_last_log_id ON log_groups(last_log_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_log_groups_pet_id ON log_groups(pet_id)")
+    _legacy_rebuild_groups(db)
+
+
+def _legacy_rebuild_groups(db):
+    # Backfill against the string-typed feeding_logs of migrations 1-8;
+    # activity.rebuild_groups() reads the compact format of migration 9.
+    group = None
+    groups = []
+    for log_id, pet_id, pet_name, event_type, details, timestamp in db.execute(
+            "SELECT id, pet_id, pet_name, event_type, details, timestamp FROM feeding_logs ORDER BY timestamp, id"):
+        if group is not None and group[1:4] == [pet_name, event_type, details]:
+            group[4], group[5], group[7] = timestamp, group[5] + 1, log_id
+            continue
+        group = [pet_id, pet_name, event_type, details, timestamp, 1, log_id, log_id]
+        groups.append(group)
+    db.executemany("""
+        INSERT INTO log_groups (pet_id, pet_name, event_type, details, timestamp, count, first_log_id, last_log_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, groups)
+
+
+def _add_scan_receipts(db):
+    # Idempotency keys of replayed scans and the result sent back for each.
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS scan_receipts (
+            feeder TEXT,
+            key TEXT,
+            response TEXT,
+            received_at TEXT,
+            PRIMARY KEY (feeder, key)
+        )
+    """)
+
+
+def _add_daily_rollups(db):
+    # Per pet and day totals of log rows that retention has pruned.
+    # pet_id 0 collects unknown tags.
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            pet_id INTEGER,
+            day TEXT,
+            pet_name TEXT,
+            dispensed INTEGER DEFAULT 0,
+            denied INTEGER DEFAULT 0,
+            daily_limit_denials INTEGER DEFAULT 0,
+            cooldown_denials INTEGER DEFAULT 0,
+            unknown_denials INTEGER DEFAULT 0,
+            portion_seconds INTEGER DEFAULT 0,
+            PRIMARY KEY (pet_id, day)
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_log_groups_timestamp ON log_groups(timestamp)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_scan_receipts_received_at ON scan_receipts(received_at)")
+
+
+def _add_registration_sessions(db):
+    # One registration window per feeder, shared by all server workers.
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS registration_sessions (
+            feeder TEXT PRIMARY KEY,
+            active INTEGER DEFAULT 0,
+            expires_at REAL,
+            captured_uid TEXT,
+            error TEXT
+        )
+    """)
+
+
+def _legacy_log_rows(rows):
+    for log_id, pet_id, event_type, details, timestamp in rows:
+        when = parse_legacy_timestamp(timestamp)
+        yield (log_id, pet_id) + encode_legacy(event_type, details) + (to_epoch_ms(when) if when else 0,)
+
+
+def _compact_feeding_logs(db, chunk_size=10000):
+    # Integer epoch-millisecond timestamps, an event code with structured
+    # value/note fields instead of event_type/details text, and pet names
+    # read from pets instead of being copied onto every row. Log ids are
+    # kept; log_groups is rebuilt, so the generation is bumped.
+    db.execute("""
+        CREATE TABLE feeding_logs_compact (
+            id INTEGER PRIMARY KEY,
+            pet_id INTEGER REFERENCES pets(id),
+            event INTEGER NOT NULL,
+            value INTEGER,
+            note TEXT,
+            timestamp INTEGER NOT NULL
+        )
+    """)
+    cursor = db.execute("SELECT id, pet_id, event_type, details, timestamp FROM feeding_logs ORDER BY id")
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            break
+        db.executemany(
+            "INSERT INTO feeding_logs_compact (id, pet_id, event, value, note, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            _legacy_log_rows(chunk)
+        )
+    db.execute("DROP TABLE feeding_logs")
+    db.execute("ALTER TABLE feeding_logs_compact RENAME TO feeding_logs")
+    db.execute("CREATE INDEX idx_feeding_logs_pet_event_time ON feeding_logs(pet_id, event, timestamp)")
+    db.execute("CREATE INDEX idx_feeding_logs_timestamp ON feeding_logs(timestamp)")
+
+    db.execute("DROP TABLE log_groups")
+    db.execute("""
+        CREATE TABLE log_groups (
+            id INTEGER PRIMARY KEY,
+            pet_id INTEGER,
+            event INTEGER,
+            value INTEGER,
+            note TEXT,
+            timestamp INTEGER,
+            count INTEGER,
+            first_log_id INTEGER,
+            last_log_id INTEGER
+        )
+    """)
+    db.execute("CREATE INDEX idx_log_groups_last_log_id ON log_groups(last_log_id)")
+    db.execute("CREATE INDEX idx_log_groups_pet_id ON log_groups(pet_id)")
+    db.execute("CREATE INDEX idx_log_groups_timestamp ON log_groups(timestamp)")
+    rebuild_groups(db)
+    db.execute("UPDATE log_meta SET value = value + 1 WHERE key = 'generation'")
+
+    # received_at was declared TEXT, which would turn integers back into
+    # strings, so the table is rebuilt as well.
+    db.execute("""
+        CREATE TABLE scan_receipts_compact (
+            feeder TEXT,
+            key TEXT,
+            response TEXT,
+            received_at INTEGER,
+            PRIMARY KEY (feeder, key)
+        )
+    """)
+    receipts = db.execute("SELECT feeder, key, response, received_at FROM scan_receipts").fetchall()
+    db.executemany("INSERT INTO scan_receipts_compact VALUES (?, ?, ?, ?)", [
+        (feeder, key, response, to_epoch_ms(parse_legacy_timestamp(received_at)) if received_at else 0)
+        for feeder, key, response, received_at in receipts
+    ])
+    db.execute("DROP TABLE scan_receipts")
+    db.execute("ALTER TABLE scan_receipts_compact RENAME TO scan_receipts")
+    db.execute("CREATE INDEX idx_scan_receipts_received_at ON scan_receipts(received_at)")
+
+
+def _add_pet_purges(db):
+    # Pets deleted while their logs are still being removed in the
+    # background. pets is rebuilt with AUTOINCREMENT so a new pet can never
+    # take over the id, and with it the logs, rollups or archives, of a
+    # deleted one.
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS pet_purges (
+            pet_id INTEGER PRIMARY KEY,
+            requested_at INTEGER
+        )
+    """)
+    db.execute("""
+        CREATE TABLE pets_autoincrement (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            rfid_uid TEXT,
+            portion_size INTEGER DEFAULT 5,
+            cooldown_min INTEGER DEFAULT 60,
+            max_daily_feeds INTEGER DEFAULT 3
+        )
+    """)
+    db.execute("""
+        INSERT INTO pets_autoincrement (id, name, rfid_uid, portion_size, cooldown_min, max_daily_feeds)
+        SELECT id, name, rfid_uid, portion_size, cooldown_min, max_daily_feeds FROM pets
+    """)
+    db.execute("DROP TABLE pets")
+    db.execute("ALTER TABLE pets_autoincrement RENAME TO pets")
+    db.execute("CREATE UNIQUE INDEX idx_pets_rfid_uid ON pets(rfid_uid)")
+    # Ids of pets deleted before this migration are not handed out again either.
+    db.execute("DELETE FROM sqlite_sequence WHERE name = 'pets'")
+    db.execute("""
+        INSERT INTO sqlite_sequence (name, seq) SELECT 'pets', MAX(
+            (SELECT COALESCE(MAX(id), 0) FROM pets),
+            (SELECT COALESCE(MAX(pet_id), 0) FROM feeding_logs),
+            (SELECT COALESCE(MAX(pet_id), 0) FROM daily_rollups)
+        )
+    """)
+
+
+def _add_pets_generation(db):
+    # Bumped with every change to pets and when logs are cleared, so each
+    # worker process knows when its in-memory eligibility state is out of date.
+    db.execute("INSERT OR IGNORE INTO log_meta (key, value) VALUES ('pets_generation', 0)")
+
+
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "reconcile pets columns with db.py schema", _reconcile_pets),
+    (3, "indexes on pets.rfid_uid and feeding_logs", _add_indexes),
+    (4, "log_meta generation counter", _add_log_meta),
+    (5, "run-length grouped log_groups", _add_log_groups),
+    (6, "scan_receipts for batch replay", _add_scan_receipts),
+    (7, "daily_rollups for log retention", _add_daily_rollups),
+    (8, "per-feeder registration_sessions", _add_registration_sessions),
+    (9, "compact feeding_logs and log_groups encoding", _compact_feeding_logs),
+    (10, "pet_purges and never reused pet ids", _add_pet_purges),
+    (11, "log_meta pets_generation counter", _add_pets_generation),
+]
+
+
+def current_version(db):
+    row = db.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+    return row[0] or 0
+
+
+def migrate(db, target=None):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT
+        )
+    """)
+    db.commit()
+
+    version = current_version(db)
+    for number, name, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        if target is not None and number > target:
+            break
+
+        # Every worker process runs migrate() on startup. The version is
+        # read again under the write lock, so a migration another process
+        # applied in the meantime is not applied twice.
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(db) >= number:
+                db.rollback()
+                version = number
+                continue
+            apply(db)
+            db.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                (number, name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            )
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        version = number
+
+    return version
@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+
+FIELDS = ("name", "rfid_uid", "portion_size", "cooldown_min", "max_daily_feeds")
+
+# (minimum, maximum) of the integer settings, as on the dashboard form.
+LIMITS = {"portion_size": (1, 30), "cooldown_min": (0, None), "max_daily_feeds": (1, None)}
+
+FORMATS = {"csv": "text/csv", "json": "application/json"}
+
+
+def parse_pets(text, fmt):
+    """Records from an uploaded CSV (with a header row) or JSON document.
+
+    JSON may be a list of objects or {"pets": [...]}. Raises ValueError when
+    the document itself cannot be read.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or "rfid_uid" not in reader.fieldnames:
+            raise ValueError("CSV needs a header row with an rfid_uid column")
+        # Empty cells leave the setting alone, like a missing JSON key.
+        return [{key: value for key, value in row.items() if key and value not in (None, "")} for row in reader]
+    if fmt == "json":
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("pets")
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            raise ValueError("JSON must be a list of pet objects or {\"pets\": [...]}")
+        return data
+    raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+
+
+def validate(records):
+    """(pets, errors): (row, record) pairs that passed and one error per rejected row.
+
+    Rows are numbered from 1 in upload order. Settings not given are left
+    out, so an update keeps the current value and an insert gets the column
+    default.
+    """
+    pets, errors, seen = [], [], {}
+    for row, record in enumerate(records, 1):
+        pet, problems = {}, []
+        for field in ("name", "rfid_uid"):
+            if field == "name" and field not in record:
+                continue
+            value = record.get(field)
+            value = str(value).strip() if value is not None else ""
+            if value:
+                pet[field] = value
+            else:
+                problems.append(f"{field} must not be empty")
+        for field, (low, high) in LIMITS.items():
+            if record.get(field) is None:
+                continue
+            try:
+                value = int(record[field])
+            except (TypeError, ValueError):
+                problems.append(f"{field} must be an integer")
+                continue
+            if value < low or (high is not None and value > high):
+                problems.append(f"{field} must be at least {low}" + (f" and at most {high}" if high else ""))
+            pet[field] = value
+        unknown = sorted(set(record) - set(FIELDS) - {"id"})
+        if unknown:
+            problems.append(f"unknown fields: {', '.join(unknown)}")
+
+        uid = pet.get("rfid_uid")
+        if uid in seen:
+            problems.append(f"rfid_uid repeats row {seen[uid]}")
+        elif uid:
+            seen[uid] = row
+        if problems:
+            errors.append({"row": row, "rfid_uid": uid, "errors": problems})
+        else:
+            pets.append((row, pet))
+    return pets, errors
+
+
+def import_pets(db, pets, dry_run=False):
+    """Insert or update validated pets by rfid_uid in one transaction.
+
+    Takes the pairs from validate(). Records with the same set of fields
+    share one executemany. A record without a name can only update an
+    existing pet; for a new tag it is reported and nothing is written.
+    Returns the report counts and any such errors.
+    """
+    existing = {uid for uid, in db.execute("SELECT rfid_uid FROM pets")}
+    missing = [{"row": row, "rfid_uid": pet["rfid_uid"], "errors": ["name is required for a new tag"]}
+               for row, pet in pets if "name" not in pet and pet["rfid_uid"] not in existing]
+    report = {
+        "inserted": sum(pet["rfid_uid"] not in existing for _, pet in pets) - len(missing),
+        "updated": sum(pet["rfid_uid"] in existing for _, pet in pets),
+    }
+    if missing or dry_run:
+        return report, missing
+
+    by_fields = {}
+    for _, pet in pets:
+        by_fields.setdefault(tuple(field for field in FIELDS if field in pet), []).append(pet)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for fields, group in by_fields.items():
+            updates = ", ".join(f"{field} = excluded.{field}" for field in fields if field != "rfid_uid")
+            db.executemany(f"""
+                INSERT INTO pets ({", ".join(fields)}) VALUES ({", ".join(":" + field for field in fields)})
+                ON CONFLICT (rfid_uid) DO {f"UPDATE SET {updates}" if updates else "NOTHING"}
+            """, group)
+        db.execute("UPDATE log_meta SET value = value + 1 WHERE key = 'pets_generation'")
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return report, []
+
+
+def export_pets(db, fmt):
+    rows = [dict(zip(("id",) + FIELDS, row)) for row in db.execute(
+        f"SELECT id, {', '.join(FIELDS)} FROM pets ORDER BY id"
+    )]
+    if fmt == "json":
+        return json.dumps({"pets": rows}, indent=2)
+    out = io.StringIO()
+    writer = csv.DictWriter(out, ("id",) + FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue()
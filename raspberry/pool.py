@@ -0,0 +1,60 @@
+import sqlite3
+import threading
+
+
+class ConnectionPool:
+    """Reusable SQLite connections for request handlers.
+
+    Connections are checked out for the duration of a request and returned
+    afterwards instead of being closed, so pragmas are applied once and each
+    connection keeps its prepared statement cache warm across requests.
+    """
+
+    def __init__(self, path, size=8, journal_mode="WAL", synchronous="NORMAL",
+                 cache_kb=8192, busy_timeout_ms=5000, cached_statements=256, factory=sqlite3.Connection):
+        self.path = path
+        self.factory = factory
+        self.size = size
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_kb = cache_kb
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def connect(self):
+        db = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=self.factory,
+        )
+        db.row_factory = sqlite3.Row
+        db.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        db.execute(f"PRAGMA synchronous = {self.synchronous}")
+        db.execute(f"PRAGMA cache_size = -{self.cache_kb}")
+        db.execute("PRAGMA temp_store = MEMORY")
+        return db
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.connect()
+
+    def release(self, db):
+        if db.in_transaction:
+            db.rollback()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(db)
+                return
+        db.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for db in idle:
+            db.close()
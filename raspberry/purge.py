@@ -0,0 +1,95 @@
+import sqlite3
+import threading
+import time
+
+from logformat import to_epoch_ms
+
+
+def request_purge(db, pet_ids, now):
+    """Delete pets and queue their logs for background removal.
+
+    Runs in the caller's transaction; commit to make it happen. The pets
+    disappear at once, their feeding_logs and log_groups rows are removed
+    by PurgeWorker.
+    """
+    db.executemany("INSERT OR IGNORE INTO pet_purges (pet_id, requested_at) VALUES (?, ?)",
+                   [(pet_id, to_epoch_ms(now)) for pet_id in pet_ids])
+    return db.executemany("DELETE FROM pets WHERE id = ?", [(pet_id,) for pet_id in pet_ids]).rowcount
+
+
+class PurgeWorker:
+    """Deletes the log history of deleted pets in small chunks.
+
+    Pending pets are read from pet_purges, so a purge interrupted by a
+    restart continues on the next start, and any worker process may pick
+    it up. Each chunk is its own short transaction with a pause in between,
+    so scan writers keep going while years of logs are removed. on_done is
+    called after a pet's history is gone.
+    """
+
+    def __init__(self, connect, chunk_size=500, pause=0.05, on_done=None):
+        self.connect = connect
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.on_done = on_done
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="purge", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                purged = self.run_once()
+                if purged:
+                    print(f"Purge: removed {purged} log rows of deleted pets")
+            except sqlite3.Error as e:
+                print(f"Purge: pass failed: {e}")
+                self._stop.wait(1)
+                continue
+            self._wake.wait()
+
+    def run_once(self):
+        db = self.connect()
+        purged = 0
+        try:
+            for pet_id, in db.execute("SELECT pet_id FROM pet_purges ORDER BY requested_at").fetchall():
+                # Groups first: they are what dashboards show.
+                for table in ("log_groups", "feeding_logs"):
+                    while not self._stop.is_set():
+                        with db:
+                            deleted = db.execute(
+                                f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE pet_id = ? LIMIT ?)",
+                                (pet_id, self.chunk_size)
+                            ).rowcount
+                        if table == "feeding_logs":
+                            purged += deleted
+                        if deleted < self.chunk_size:
+                            break
+                        time.sleep(self.pause)
+                if self._stop.is_set():
+                    break
+                with db:
+                    db.execute("DELETE FROM pet_purges WHERE pet_id = ?", (pet_id,))
+                    db.execute("UPDATE log_meta SET value = value + 1 WHERE key = 'generation'")
+                if self.on_done:
+                    self.on_done(pet_id)
+        finally:
+            db.close()
+        return purged
@@ -0,0 +1,71 @@
+import time
+
+# A session started without a feeder id captures the next scan from any feeder.
+ANY_FEEDER = "*"
+
+
+class RegistrationSessions:
+    """Tag registration windows, one per feeder.
+
+    Sessions live in the registration_sessions table so every server worker
+    sees the same state, and claiming one is a conditional UPDATE, so exactly
+    one scan captures each window even when workers race for it.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+
+    def start(self, db, feeder=ANY_FEEDER, now=None):
+        now = now or time.time()
+        db.execute("""
+            INSERT INTO registration_sessions (feeder, active, expires_at, captured_uid, error)
+            VALUES (?, 1, ?, NULL, NULL)
+            ON CONFLICT (feeder) DO UPDATE SET
+                active = 1, expires_at = excluded.expires_at, captured_uid = NULL, error = NULL
+        """, (feeder, now + self.ttl))
+        db.commit()
+
+    def claim(self, db, feeder, now=None):
+        """Consume the open session for this feeder, or an any-feeder one.
+
+        Returns the session's feeder key, or None when no window is open,
+        which is the common case and costs a single read.
+        """
+        now = now or time.time()
+        rows = db.execute(
+            "SELECT feeder FROM registration_sessions WHERE active = 1 AND expires_at > ? AND feeder IN (?, ?)",
+            (now, feeder or ANY_FEEDER, ANY_FEEDER)
+        ).fetchall()
+        if not rows:
+            return None
+
+        # A window opened for this feeder wins over an any-feeder one.
+        keys = sorted((row[0] for row in rows), key=lambda key: key == ANY_FEEDER)
+        for key in keys:
+            claimed = db.execute(
+                "UPDATE registration_sessions SET active = 0 WHERE feeder = ? AND active = 1 AND expires_at > ?",
+                (key, now)
+            ).rowcount
+            db.commit()
+            if claimed:
+                return key
+        return None
+
+    def capture(self, db, key, uid=None, error=None):
+        db.execute(
+            "UPDATE registration_sessions SET captured_uid = ?, error = ? WHERE feeder = ?",
+            (uid, error, key)
+        )
+        db.commit()
+
+    def take_captured(self, db, feeder=ANY_FEEDER):
+        row = db.execute(
+            "SELECT captured_uid, error FROM registration_sessions WHERE feeder = ?", (feeder,)
+        ).fetchone()
+        if row is None or (row[0] is None and row[1] is None):
+            return None, None
+        db.execute(
+            "UPDATE registration_sessions SET captured_uid = NULL, error = NULL WHERE feeder = ?", (feeder,)
+        )
+        db.commit()
+        return row[0], row[1]
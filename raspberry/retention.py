@@ -0,0 +1,183 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from logformat import (DISPENSED, DENIED_DAILY_LIMIT, DENIED_COOLDOWN, DENIED_UNKNOWN, day_start_ms,
+                       format_entry, format_timestamp, from_epoch_ms)
+
+SELECT_EXPIRED = """
+    SELECT l.id, l.pet_id, p.name AS pet_name, l.event, l.value, l.note, l.timestamp
+    FROM feeding_logs l LEFT JOIN pets p ON p.id = l.pet_id
+    WHERE l.timestamp < ? ORDER BY l.timestamp LIMIT ?
+"""
+
+UPSERT_ROLLUP = """
+    INSERT INTO daily_rollups (pet_id, day, pet_name, dispensed, denied, daily_limit_denials,
+                               cooldown_denials, unknown_denials, portion_seconds)
+    VALUES (:pet_id, :day, :pet_name, :dispensed, :denied, :daily_limit_denials,
+            :cooldown_denials, :unknown_denials, :portion_seconds)
+    ON CONFLICT (pet_id, day) DO UPDATE SET
+        dispensed = dispensed + excluded.dispensed,
+        denied = denied + excluded.denied,
+        daily_limit_denials = daily_limit_denials + excluded.daily_limit_denials,
+        cooldown_denials = cooldown_denials + excluded.cooldown_denials,
+        unknown_denials = unknown_denials + excluded.unknown_denials,
+        portion_seconds = portion_seconds + excluded.portion_seconds
+"""
+
+
+def rollup(rows):
+    # Per (pet, day) counters for a chunk of feeding_logs rows. Unknown tags
+    # are counted under pet_id 0.
+    days = {}
+    for row in rows:
+        pet_id = row["pet_id"] or 0
+        day = from_epoch_ms(row["timestamp"]).strftime('%Y-%m-%d')
+        entry = days.get((pet_id, day))
+        if entry is None:
+            entry = days[(pet_id, day)] = {
+                "pet_id": pet_id, "day": day, "pet_name": row["pet_name"] or "Unknown", "dispensed": 0,
+                "denied": 0, "daily_limit_denials": 0, "cooldown_denials": 0, "unknown_denials": 0,
+                "portion_seconds": 0,
+            }
+        event = row["event"]
+        if event == DISPENSED:
+            entry["dispensed"] += 1
+            entry["portion_seconds"] += row["value"] or 0
+        else:
+            entry["denied"] += 1
+            if event == DENIED_DAILY_LIMIT:
+                entry["daily_limit_denials"] += 1
+            elif event == DENIED_COOLDOWN:
+                entry["cooldown_denials"] += 1
+            elif event == DENIED_UNKNOWN:
+                entry["unknown_denials"] += 1
+    return list(days.values())
+
+
+class RetentionWorker:
+    """Keeps feeding_logs down to the last `days` days.
+
+    Older rows are archived to gzip'd JSON Lines files (one per month),
+    counted into daily_rollups and deleted, one small transaction per chunk
+    so scan writers are never blocked for long.
+    """
+
+    def __init__(self, connect, days=90, archive_dir="archive", chunk_size=500, interval=3600, pause=0.05):
+        if days < 2:
+            raise ValueError("retention must keep at least two days of logs")
+        self.connect = connect
+        self.days = days
+        self.archive_dir = archive_dir
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                pruned = self.run_once()
+                if pruned:
+                    print(f"Retention: archived and pruned {pruned} log rows")
+            except (sqlite3.Error, OSError) as e:
+                print(f"Retention: pass failed: {e}")
+            self._stop.wait(self.interval)
+
+    def cutoff(self, now=None):
+        now = now or datetime.now()
+        return day_start_ms(now - timedelta(days=self.days))
+
+    def run_once(self, now=None):
+        cutoff = self.cutoff(now)
+        db = self.connect()
+        db.row_factory = sqlite3.Row
+        pruned = 0
+        try:
+            while not self._stop.is_set():
+                count = self._prune_chunk(db, cutoff)
+                if not count:
+                    break
+                pruned += count
+                time.sleep(self.pause)
+            self._prune_side_tables(db, cutoff)
+        finally:
+            db.close()
+        return pruned
+
+    def _prune_chunk(self, db, cutoff):
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute(SELECT_EXPIRED, (cutoff, self.chunk_size)).fetchall()
+            if not rows:
+                db.rollback()
+                return 0
+
+            # Archive before the delete commits; a crash in between can only
+            # duplicate archive lines, never lose rows.
+            self._archive(rows)
+            db.executemany(UPSERT_ROLLUP, rollup(rows))
+            db.executemany("DELETE FROM feeding_logs WHERE id = ?", [(row["id"],) for row in rows])
+            db.commit()
+            return len(rows)
+        except BaseException:
+            db.rollback()
+            raise
+
+    def _archive(self, rows):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        # Archived rows keep the readable pre-compaction shape.
+        by_month = {}
+        for row in rows:
+            entry = dict(id=row["id"], pet_id=row["pet_id"],
+                         **format_entry(row["pet_name"], row["event"], row["value"], row["note"], row["timestamp"]))
+            by_month.setdefault(entry["timestamp"][:7], []).append(entry)
+        for month, entries in by_month.items():
+            path = os.path.join(self.archive_dir, f"feeding_logs-{month}.jsonl.gz")
+            # Appending adds a gzip member; gzip.open reads them back as one stream.
+            with gzip.open(path, "at", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+
+    def _prune_side_tables(self, db, cutoff):
+        for table, column in (("log_groups", "timestamp"), ("scan_receipts", "received_at")):
+            while not self._stop.is_set():
+                with db:
+                    deleted = db.execute(
+                        f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {column} < ? LIMIT ?)",
+                        (cutoff, self.chunk_size)
+                    ).rowcount
+                if deleted < self.chunk_size:
+                    break
+                time.sleep(self.pause)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from pool import ConnectionPool
+
+    parser = argparse.ArgumentParser(description="Archive and prune feeding_logs once.")
+    parser.add_argument("--db", default=os.environ.get("PET_FEEDER_DB", "pets.db"))
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--archive-dir", default="archive")
+    args = parser.parse_args()
+
+    worker = RetentionWorker(ConnectionPool(args.db).connect, days=args.days, archive_dir=args.archive_dir)
+    print(f"Pruned {worker.run_once()} rows older than {format_timestamp(worker.cutoff())}")
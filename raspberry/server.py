@@ -1,177 +1,790 @@
-from flask import Flask, request, g, render_template_string, jsonify
-import sqlite3
-from datetime import datetime
-
-DB = "pets.db"
+from flask import Flask, Response, request, g, jsonify
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from activity import append_logs, recent_groups, groups_since
+from analytics import pet_analytics
+from debounce import ScanDebouncer
+from events import EventBus
+from eligibility import (EligibilityEngine, Decision, check_history, find_pet, load_pet, AUTHORIZED,
+                         DAILY_LIMIT, COOLDOWN, UNKNOWN)
+from export import LogExport, EVENT_FILTERS, FORMATS
+from logformat import (DISPENSED, DENIED_DAILY_LIMIT, DENIED_COOLDOWN, DENIED_UNKNOWN, TIMESTAMP_FORMAT,
+                       to_epoch_ms, format_entry)
+import lean
+from log_writer import LogWriter
+from metrics import registry, Gauge, TimedConnection, DECISIONS, REQUEST_SECONDS
+from migrations import migrate
+from pets import parse_pets, validate, import_pets, export_pets, FORMATS as PET_FORMATS
+from pool import ConnectionPool
+from purge import PurgeWorker, request_purge
+from registration import RegistrationSessions, ANY_FEEDER
+from retention import RetentionWorker
+
+DB = os.environ.get("PET_FEEDER_DB", "pets.db")
+
+# Request handlers borrow connections from a pool of at most DB_POOL_SIZE idle
+# connections. WAL lets dashboard reads proceed while scans are being logged.
+DB_POOL_SIZE = 8
+DB_JOURNAL_MODE = "WAL"
+DB_SYNCHRONOUS = "NORMAL"
+DB_CACHE_KB = 8192
+
+# Write-behind logging: rows are committed in groups of up to LOG_BATCH_SIZE
+# or after LOG_FLUSH_INTERVAL seconds; a full queue blocks scans. Requests
+# that wait for queued rows give up after LOG_FLUSH_TIMEOUT seconds.
+LOG_BATCH_SIZE = 64
+LOG_FLUSH_INTERVAL = 0.25
+LOG_QUEUE_SIZE = 10000
+LOG_FLUSH_TIMEOUT = 10.0
+
+# Raw logs older than RETENTION_DAYS are rolled up into daily_rollups, archived
+# under ARCHIVE_DIR and pruned every RETENTION_INTERVAL seconds.
+RETENTION_DAYS = 90
+ARCHIVE_DIR = "archive"
+RETENTION_INTERVAL = 3600
+
+# Seconds a registration window stays open waiting for a tag scan.
+REGISTRATION_TTL = 120
+
+# Seconds during which repeated posts of the same tag from the same feeder
+# get the first scan's answer without being decided or logged again.
+DEBOUNCE_WINDOW = 3.0
+
+# Seconds asgi.py keeps an idle feeder connection open for its next scan. The
+# Flask development server closes every connection after one response.
+KEEPALIVE_TIMEOUT = 60
+
+# Formats of /api/eligibility. ETags carry a per-process token, since each
+# worker counts engine versions on its own.
+HINT_FORMATS = {"json": "application/json", "lean": lean.CONTENT_TYPE}
+HINT_ETAG_TOKEN = f"{os.getpid():x}{int(time.time()):x}"
+
+# Largest number of scans accepted by one /tag/batch request.
+MAX_BATCH_SCANS = 500
+
+# Largest number of pets accepted by one /api/pets/import upload.
+MAX_IMPORT_PETS = 5000
+
+# Rows per query while streaming /api/logs/export.
+EXPORT_CHUNK_ROWS = 1000
+
+# Days covered by /api/analytics when no `from` date is given.
+ANALYTICS_DEFAULT_DAYS = 30
+
+# Seconds between keep-alive comments on idle /api/logs/stream connections.
+STREAM_HEARTBEAT = 15
+
+# The rendered dashboard is reused until a pet is registered, imported or deleted here,
+# or for at most DASHBOARD_MAX_AGE seconds so changes made through another
+# worker process show up too.
+DASHBOARD_MAX_AGE = 30
 
 app = Flask(__name__)
 
-pending_registration = {"active": False, "timestamp": None}
+pool = ConnectionPool(DB, size=DB_POOL_SIZE, journal_mode=DB_JOURNAL_MODE,
+                      synchronous=DB_SYNCHRONOUS, cache_kb=DB_CACHE_KB, factory=TimedConnection)
+engine = EligibilityEngine()
+bus = EventBus()
+
+
+# Held from each commit of log rows until they are published, by request
+# threads and the log writer alike, so the bus sees ids in commit order.
+publish_lock = threading.Lock()
+
+
+def publish_logs(entries):
+    for log_id, group_id, count, (pet_id, pet_name, event, value, note, timestamp) in entries:
+        bus.publish("log", json.dumps(dict(
+            format_entry(pet_name, event, value, note, timestamp), id=log_id, group_id=group_id, count=count
+        )))
+
+
+def publish_counts(counts):
+    # Debounced repeats only raise the count of a group the client has.
+    for group_id, count in counts.items():
+        bus.publish("group", json.dumps({"group_id": group_id, "count": count}))
+
+
+def commit_and_publish(db, entries):
+    with publish_lock:
+        db.commit()
+        publish_logs(entries)
+
+
+def connect_as(role):
+    # Background threads get their own connections, labelled in commit metrics.
+    def connect():
+        db = pool.connect()
+        db.role = role
+        return db
+    return connect
+
+
+log_writer = LogWriter(connect_as("log_writer"), max_batch=LOG_BATCH_SIZE, max_delay=LOG_FLUSH_INTERVAL,
+                       max_queue=LOG_QUEUE_SIZE, flush_timeout=LOG_FLUSH_TIMEOUT,
+                       on_commit=publish_logs, on_repeats=publish_counts, commit_lock=publish_lock)
+atexit.register(log_writer.close)
+registry.register(Gauge("log_writer_queue_rows", "Log rows queued but not yet committed.", log_writer.pending))
+retention = RetentionWorker(connect_as("retention"), days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR,
+                            interval=RETENTION_INTERVAL)
+atexit.register(retention.stop)
+purger = PurgeWorker(connect_as("purge"), on_done=lambda pet_id: bus.reset())
+atexit.register(purger.stop)
+atexit.register(pool.close_all)
+
+registrations = RegistrationSessions(ttl=REGISTRATION_TTL)
+debouncer = ScanDebouncer(window=DEBOUNCE_WINDOW)
+# Registered after log_writer.close, so it runs before it.
+atexit.register(lambda: log_writer.submit_repeats(debouncer.drain()))
 
 
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(DB)
-        g.db.row_factory = sqlite3.Row
+        g.db = pool.acquire()
     return g.db
 
 
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    return response
+
+
 @app.teardown_appcontext
-def close_db():
+def close_db(exception=None):
     db = g.pop("db", None)
     if db:
-        db.close()
+        pool.release(db)
+
+
+def migrate_db(db):
+    # One-off statements; kept out of sqlite_query_duration_seconds.
+    db.timed = False
+    try:
+        migrate(db)
+    finally:
+        db.timed = True
 
 
 def init_db():
     with app.app_context():
-        db = get_db()
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS pets (
-                id INTEGER PRIMARY KEY, 
-                name TEXT, 
-                rfid_uid TEXT,
-                portion_size INTEGER DEFAULT 5,
-                cooldown_min INTEGER DEFAULT 60,
-                max_daily_feeds INTEGER DEFAULT 3
-            )
-        """)
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS feeding_logs (
-                id INTEGER PRIMARY KEY, 
-                pet_id INTEGER,
-                pet_name TEXT,
-                event_type TEXT,
-                details TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(pet_id) REFERENCES pets(id)
-            )
-        """)
-        db.commit()
+        migrate_db(get_db())
 
 
-def log_event(pet_id, pet_name, event_type, details):
-    db = get_db()
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
-    db.execute(
-        "INSERT INTO feeding_logs (pet_id, pet_name, event_type, details, timestamp) VALUES (?, ?, ?, ?, ?)",
-        (pet_id, pet_name, event_type, details, timestamp)
-    )
-    db.commit()
+def warm_engine():
+    with app.app_context():
+        engine.warm(get_db())
 
 
-@app.route('/tag', methods=['POST'])
-def scan():
-    data = request.get_json(silent=True)
+def log_event(pet_id, pet_name, event, value, note, now=None):
+    now = now or datetime.now()
+    # Write-behind, for denials only: dispenses are committed by dispense()
+    # before the feeder is answered.
+    log_writer.submit(pet_id, pet_name, event, value, note, to_epoch_ms(now))
+
+
+def handle_scan(db, data):
     if not data or 'uid' not in data:
-        return jsonify({"error": "UID missing"}), 400
+        return {"error": "UID missing"}, 400
 
     tag_id = data.get('uid')
+    feeder = data.get('feeder')
+    log_writer.submit_repeats(debouncer.expired())
+    # An open registration window takes the scan even if the tag was seen a
+    # moment ago. The window may have been opened through another worker,
+    # so this is checked in the database rather than in the debouncer.
+    session = registrations.claim(db, feeder)
+    if session is None:
+        repeat = debouncer.lookup(feeder, tag_id)
+        if repeat is not None:
+            (body, status), outcome = repeat
+            DECISIONS.inc("debounced", outcome)
+            return body, status
+
     print(f"Received scan for UID: {tag_id}")
 
-    if pending_registration["active"]:
-        pending_registration["active"] = False
-        db = get_db()
-        existing_pet = db.execute("SELECT * FROM pets WHERE rfid_uid = ?", (tag_id,)).fetchone()
+    sync_engine(db)
+
+    if session is not None:
+        existing_pet = engine.lookup(tag_id) or find_pet(db, tag_id)
 
         if existing_pet:
-            pending_registration["error"] = f"Tag already belongs to {existing_pet['name']}"
-            return jsonify({"status": "error", "message": "Tag already registered"}), 409
+            registrations.capture(db, session, error=f"Tag already belongs to {existing_pet.name}")
+            return {"status": "error", "message": "Tag already registered"}, 409
+
+        registrations.capture(db, session, uid=tag_id)
+        return {"status": "registration", "message": "Tag captured", "uid": tag_id}, 200
+
+    now = datetime.now()
+    decision = engine.check(tag_id, now)
+    if decision.status == UNKNOWN and find_pet(db, tag_id) is not None:
+        # Added without a pets_generation bump, e.g. from the sqlite3 shell.
+        engine.warm(db)
+        decision = engine.check(tag_id, now)
+    if decision.status == AUTHORIZED:
+        # The engine only knows what this process logged; the database has
+        # the final say on everything it would let through.
+        decision, logged = dispense(db, decision.pet.id, now)
+        if logged:
+            engine.record(decision.pet.id, DISPENSED, now)
+        elif decision.pet is not None:
+            engine.refresh(db, decision.pet.id, now)
+        else:
+            # Deleted by another worker.
+            engine.warm(db)
+
+    DECISIONS.inc("tag", decision.status)
+    log_row, (body, status) = describe(decision, tag_id)
+    if decision.status != AUTHORIZED:
+        log_event(*log_row, now)
+    if decision.status == AUTHORIZED:
+        # Repeats must not dispense again, nor show up as more feeds.
+        cached, log_key = ({"status": "denied", "message": "Already dispensed"}, 403), None
+    else:
+        pet_id, _, event, _, note = log_row
+        cached, log_key = (body, status), (pet_id, event, note, to_epoch_ms(now))
+    log_writer.submit_repeats(debouncer.remember(feeder, tag_id, cached, decision.status, log_key))
+    return body, status
+
+
+def sync_engine(db):
+    # Rebuild when this or another worker changed pets or cleared the logs.
+    if engine.stale(db):
+        log_writer.flush()
+        engine.warm(db)
+
+
+def handle_lean_scan(db, data, feeder=None):
+    # /tag/lean: the UID as the raw body, two bytes back (see lean.py).
+    uid = lean.decode_uid(data)
+    if not uid:
+        return bytes((lean.ERROR, 0)), 400
+    body, _ = handle_scan(db, {"uid": uid, "feeder": feeder})
+    return lean.encode_response(body), 200
+
+
+def eligibility_etag(db, now):
+    # Engine version plus the day, since every pet rolls over at midnight.
+    sync_engine(db)
+    return f"{HINT_ETAG_TOKEN}.{engine.version}.{now.date().isoformat()}"
+
+
+def load_hints(fmt, now):
+    """When each pet may be fed next and how many feeds it has left today.
+
+    Feeders use this to turn away scans that would be denied anyway without
+    asking. Scans of tags that are not listed, or whose pet is eligible,
+    still go to /tag.
+    """
+    _, hints = engine.hints(now)
+    now_ms = to_epoch_ms(now)
+    pets = []
+    for uid, pet_id, remaining, eligible_at in hints:
+        if eligible_at is not None and eligible_at <= now_ms:
+            eligible_at = None
+        # Rounded down, so a feeder never turns away a scan /tag would allow.
+        wait_s = (eligible_at - now_ms) // 1000 if eligible_at else 0
+        pets.append({"pet_id": pet_id, "rfid_uid": uid, "remaining": remaining,
+                     "eligible_at": eligible_at, "wait_s": wait_s})
+    if fmt == "lean":
+        return lean.encode_hints(pets)
+    return {"now": now_ms, "pets": pets}
+
+
+def dispense(db, pet_id, now):
+    """Re-check a scan against the log and record the dispense in one transaction.
+
+    BEGIN IMMEDIATE takes SQLite's write lock before the check, so no other
+    connection or worker process can log a feed for the pet in between.
+    Dispensed rows are written here rather than through the log writer, so
+    every committed feed is visible to the next check. Returns the decision
+    and the logged entries, which are already published.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        pet = load_pet(db, pet_id)
+        decision = check_history(db, pet, now) if pet else Decision(UNKNOWN)
+        logged = []
+        if decision.status == AUTHORIZED:
+            log_row, _ = describe(decision, pet.rfid_uid)
+            row = log_row + (to_epoch_ms(now),)
+            logged = [result + (row,) for result in append_logs(db, [row])]
+        commit_and_publish(db, logged)
+    except Exception:
+        db.rollback()
+        raise
+    return decision, logged
+
+
+def describe(decision, tag_id):
+    # Log row and (response body, status code) for an eligibility decision.
+    pet = decision.pet
+
+    if pet is None:
+        return (None, "Unknown", DENIED_UNKNOWN, None, tag_id), \
+            ({"status": "denied", "message": "Pet not recognized"}, 403)
+
+    if decision.status == DAILY_LIMIT:
+        return (pet.id, pet.name, DENIED_DAILY_LIMIT, None, None), \
+            ({"status": "denied", "message": "Daily limit reached"}, 403)
+
+    if decision.status == COOLDOWN:
+        return (pet.id, pet.name, DENIED_COOLDOWN, decision.wait_min, None), \
+            ({"status": "denied", "message": "Diet active"}, 403)
+
+    return (pet.id, pet.name, DISPENSED, pet.portion_size, None), ({
+        "status": "authorized",
+        "message": "Feeding allowed",
+        "pet_name": pet.name,
+        "portion_time": pet.portion_size
+    }, 200)
+
+
+def parse_scan_time(value):
+    # Local naive time, like datetime.now(); an ISO offset is converted.
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    when = datetime.fromisoformat(value)
+    if when.tzinfo is not None:
+        when = when.astimezone().replace(tzinfo=None)
+    return when
+
+
+def handle_batch(db, data):
+    if not isinstance(data, dict) or not isinstance(data.get('scans'), list):
+        return {"error": "Scans missing"}, 400
+
+    scans = data['scans']
+    if len(scans) > MAX_BATCH_SCANS:
+        return {"error": f"At most {MAX_BATCH_SCANS} scans per batch"}, 413
+
+    feeder = '' if data.get('feeder') is None else str(data['feeder'])
+    latest_allowed = datetime.now() + timedelta(minutes=5)
+    results = [None] * len(scans)
+    pending = []
+
+    for index, item in enumerate(scans):
+        try:
+            tag_id = item['uid']
+            when = parse_scan_time(item['timestamp'])
+        except (KeyError, TypeError, ValueError, OverflowError, OSError):
+            results[index] = {"status": "error", "message": "uid and timestamp required", "code": 400}
+            continue
+        if when > latest_allowed:
+            results[index] = {"status": "error", "message": "Timestamp in the future", "code": 400}
+            continue
+        key = item.get('key')
+        pending.append((when, index, tag_id, None if key is None else str(key)))
+
+    # Replay in the order the scans happened so each one is judged against
+    # the feedings that preceded it, including earlier items of this batch.
+    pending.sort(key=lambda scan: (scan[0], scan[1]))
+
+    sync_engine(db)
+    log_writer.flush()
+
+    logged = []
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for when, index, tag_id, key in pending:
+            if key is not None:
+                receipt = db.execute(
+                    "SELECT response FROM scan_receipts WHERE feeder = ? AND key = ?", (feeder, key)
+                ).fetchone()
+                if receipt:
+                    results[index] = dict(json.loads(receipt[0]), duplicate=True)
+                    continue
 
-        pending_registration["last_uid"] = tag_id
-        return jsonify({"status": "registration", "message": "Tag captured", "uid": tag_id}), 200
+            pet = engine.lookup(tag_id) or find_pet(db, tag_id)
+            decision = check_history(db, pet, when) if pet else Decision(UNKNOWN)
+            DECISIONS.inc("batch", decision.status)
+            log_row, (body, status) = describe(decision, tag_id)
+            row = log_row + (to_epoch_ms(when),)
+            logged.extend(result + (row,) for result in append_logs(db, [row]))
 
-    db = get_db()
-    pet = db.execute("SELECT * FROM pets WHERE rfid_uid = ?", (tag_id,)).fetchone()
-
-    if pet:
-        pet_id = pet['id']
-        pet_name = pet['name']
-
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-
-        feed_count = db.execute(
-            "SELECT COUNT(*) FROM feeding_logs WHERE pet_id = ? AND event_type = 'Dispensed' AND timestamp >= ?",
-            (pet_id, today_start.strftime('%Y-%m-%d %H:%M:%S'))
-        ).fetchone()[0]
-
-        if feed_count >= pet['max_daily_feeds']:
-            log_event(pet_id, pet_name, "Denied", "Daily limit reached")
-            return jsonify({
-                "status": "denied",
-                "message": "Daily limit reached"
-            }), 403
-
-        last_feed = db.execute(
-            "SELECT timestamp FROM feeding_logs WHERE pet_id = ? AND event_type = 'Dispensed' ORDER BY timestamp DESC LIMIT 1",
-            (pet_id,)
-        ).fetchone()
-
-        if last_feed:
-            try:
-                last_time = datetime.strptime(last_feed['timestamp'], '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                last_time = datetime.strptime(last_feed['timestamp'], '%Y-%m-%d %H:%M:%S.%f')
-
-            minutes_since = (datetime.now() - last_time).total_seconds() / 60
-
-            if minutes_since < pet['cooldown_min']:
-                wait_time = int(pet['cooldown_min'] - minutes_since)
-                log_event(pet_id, pet_name, "Denied", f"Cooldown active ({wait_time}m left)")
-                return jsonify({
-                    "status": "denied",
-                    "message": "Diet active"
-                }), 403
-
-        log_event(pet_id, pet_name, "Dispensed", f"{pet['portion_size']}s portion")
-
-        return jsonify({
-            "status": "authorized",
-            "message": "Feeding allowed",
-            "pet_name": pet_name,
-            "portion_time": pet['portion_size']
-        }), 200
+            results[index] = dict(body, code=status, key=key, timestamp=when.strftime(TIMESTAMP_FORMAT))
+            if key is not None:
+                db.execute(
+                    "INSERT INTO scan_receipts (feeder, key, response, received_at) VALUES (?, ?, ?, ?)",
+                    (feeder, key, json.dumps(results[index]), to_epoch_ms(datetime.now()))
+                )
+        commit_and_publish(db, logged)
+    except Exception:
+        db.rollback()
+        raise
+
+    # Dispensed rows are never queued in the log writer, so only the fed
+    # pets need reloading.
+    for pet_id in {row[0] for *_, row in logged if row[2] == DISPENSED}:
+        engine.refresh(db, pet_id)
+
+    return {"results": results}, 200
+
+
+def log_head(db):
+    generation, head = db.execute("""
+        SELECT (SELECT value FROM log_meta WHERE key = 'generation'),
+               (SELECT MAX(id) FROM feeding_logs)
+    """).fetchone()
+    return generation or 0, head or 0
+
+
+def bump_log_generation(db):
+    db.execute("UPDATE log_meta SET value = value + 1 WHERE key = 'generation'")
+
+
+def bump_pets_generation(db):
+    # In the transaction of the change, so other workers re-warm their engine.
+    db.execute("UPDATE log_meta SET value = value + 1 WHERE key = 'pets_generation'")
+
+
+def log_etag(db):
+    generation, head = log_head(db)
+    return f"{generation}.{head}", generation, head
+
+
+def load_logs(db, generation, head, since=None, client_generation=None):
+    reset = since is not None and (since > head or client_generation not in (None, generation))
+
+    if since is None or reset:
+        logs = recent_groups(db)
+    else:
+        logs = groups_since(db, since)
+
+    if since is None:
+        return logs
+    # Groups that were added or grew after `since`; a group the client
+    # already shows replaces its copy by group_id.
+    return {"logs": logs, "cursor": head, "generation": generation, "reset": reset}
+
+
+def format_events(events):
+    return "".join(f"id: {event_id}\nevent: {name}\ndata: {data}\n\n" for event_id, name, data in events)
+
+
+def handle_clear_logs(db):
+    debouncer.drain()
+    log_writer.flush()
+    db.execute("DELETE FROM feeding_logs")
+    db.execute("DELETE FROM log_groups")
+    bump_log_generation(db)
+    bump_pets_generation(db)
+    db.commit()
+    engine.warm(db)
+    bus.reset()
+    return {"success": True}
+
+
+def handle_analytics(db, args):
+    try:
+        last_day = date.fromisoformat(args["to"]) if args.get("to") else date.today()
+        first_day = (date.fromisoformat(args["from"]) if args.get("from")
+                     else last_day - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1))
+        pet_ids = [int(pet_id) for pet_id in args.getlist("pet")]
+    except ValueError:
+        return {"error": "from and to must be YYYY-MM-DD dates and pet an integer id"}, 400
+    if first_day > last_day:
+        return {"error": "from is after to"}, 400
+
+    start = datetime.combine(first_day, datetime.min.time())
+    end = datetime.combine(last_day + timedelta(days=1), datetime.min.time())
+    try:
+        return pet_analytics(db, start, end, bucket=args.get("bucket", "day"), pet_ids=pet_ids), 200
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+
+def handle_export(args):
+    # Returns a LogExport to stream chunk by chunk, or an error body.
+    try:
+        first_day = date.fromisoformat(args["from"]) if args.get("from") else None
+        last_day = date.fromisoformat(args["to"]) if args.get("to") else None
+        pet_ids = [int(pet_id) for pet_id in args.getlist("pet")]
+    except ValueError:
+        return {"error": "from and to must be YYYY-MM-DD dates and pet an integer id"}, 400
+    events = args.getlist("event")
+    fmt = args.get("format", "csv")
+    if fmt not in FORMATS:
+        return {"error": f"format must be one of {', '.join(FORMATS)}"}, 400
+    if any(event not in EVENT_FILTERS for event in events):
+        return {"error": f"event must be one of {', '.join(EVENT_FILTERS)}"}, 400
+    if first_day and last_day and first_day > last_day:
+        return {"error": "from is after to"}, 400
+
+    start_ms = to_epoch_ms(datetime.combine(first_day, datetime.min.time())) if first_day else None
+    end_ms = to_epoch_ms(datetime.combine(last_day + timedelta(days=1), datetime.min.time())) if last_day else None
+    return LogExport(fmt, pet_ids=pet_ids, events=events, start_ms=start_ms, end_ms=end_ms,
+                     chunk_size=EXPORT_CHUNK_ROWS), 200
+
+
+def export_headers(export):
+    return {"Content-Disposition": f'attachment; filename="feeding_logs.{export.format}"',
+            "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def pet_export_headers(fmt):
+    return {"Content-Disposition": f'attachment; filename="pets.{fmt}"'}
+
+
+def list_pets(db):
+    return db.execute("SELECT * FROM pets").fetchall()
+
+
+def begin_registration(db, feeder=ANY_FEEDER):
+    registrations.start(db, feeder or ANY_FEEDER)
+    return {"status": "ready", "feeder": feeder or ANY_FEEDER}
+
+
+def take_captured_uid(db, feeder=ANY_FEEDER):
+    uid, error = registrations.take_captured(db, feeder or ANY_FEEDER)
+    if error:
+        return {"uid": None, "error": error}
+    return {"uid": uid}
+
+
+def handle_register(db, form):
+    record = {"name": form.get("name"), "rfid_uid": form.get("uid"), "portion_size": form.get("portion"),
+              "cooldown_min": form.get("cooldown"), "max_daily_feeds": form.get("max_feeds")}
+    if any(value in (None, "") for value in record.values()):
+        return "Missing Data", 400
+    # Same rules as an import, so every stored setting is a usable integer.
+    pets, errors = validate([record])
+    if errors:
+        return f"Invalid Data: {'; '.join(errors[0]['errors'])}", 400
+    _, pet = pets[0]
+
+    try:
+        db.execute("""
+            INSERT INTO pets (name, rfid_uid, portion_size, cooldown_min, max_daily_feeds)
+            VALUES (:name, :rfid_uid, :portion_size, :cooldown_min, :max_daily_feeds)
+        """, pet)
+        bump_pets_generation(db)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        return f"Error: {e}", 500
+
+    pets_changed(db)
+
+    return "<script>window.location='/'</script>", 200
+
+
+def pets_changed(db):
+    invalidate_dashboard()
+    # Cached answers may predate the change.
+    log_writer.submit_repeats(debouncer.drain())
+    log_writer.flush()
+    engine.warm(db)
+
+
+def delete_pets(db, pet_ids):
+    # The pets go at once; their logs are removed by the purge worker.
+    deleted = request_purge(db, pet_ids, datetime.now())
+    bump_pets_generation(db)
+    db.commit()
+    pets_changed(db)
+    purger.wake()
+    return deleted
+
+
+def handle_delete_pet(db, pet_id):
+    delete_pets(db, [pet_id])
+    return {"success": True}
+
+
+def handle_delete_pets(db, data):
+    if not isinstance(data, dict) or not isinstance(data.get("pet_ids", []), list) \
+            or not isinstance(data.get("rfid_uids", []), list):
+        return {"error": "pet_ids and rfid_uids must be lists"}, 400
+    pet_ids = set()
+    try:
+        pet_ids.update(int(pet_id) for pet_id in data.get("pet_ids", []))
+    except (TypeError, ValueError):
+        return {"error": "pet_ids must be integers"}, 400
+    uids = [str(uid) for uid in data.get("rfid_uids", [])]
+    for start in range(0, len(uids), 500):
+        chunk = uids[start:start + 500]
+        pet_ids.update(row[0] for row in db.execute(
+            f"SELECT id FROM pets WHERE rfid_uid IN ({', '.join('?' * len(chunk))})", chunk
+        ))
+    return {"deleted": delete_pets(db, sorted(pet_ids)) if pet_ids else 0}, 200
+
+
+def handle_import_pets(db, text, args, content_type=None):
+    fmt = args.get("format") or ("json" if "json" in (content_type or "") else "csv")
+    dry_run = args.get("dry_run") in ("1", "true")
+    try:
+        records = parse_pets(text, fmt)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if len(records) > MAX_IMPORT_PETS:
+        return {"error": f"At most {MAX_IMPORT_PETS} pets per import"}, 413
+
+    pets, errors = validate(records)
+    report, missing = import_pets(db, pets, dry_run=dry_run or bool(errors))
+    errors = sorted(errors + missing, key=lambda error: error["row"])
+    if errors:
+        # All or nothing: fix the listed rows and upload again.
+        return {"dry_run": dry_run, "inserted": 0, "updated": 0, "errors": errors}, 400
+    if not dry_run:
+        pets_changed(db)
+    return dict(report, dry_run=dry_run, errors=[]), 200
+
+
+def handle_export_pets(db, args):
+    fmt = args.get("format", "csv")
+    if fmt not in PET_FORMATS:
+        return {"error": f"format must be one of {', '.join(PET_FORMATS)}"}, 400
+    return export_pets(db, fmt), 200
+
+
+@app.post("/api/pets/import")
+def import_pets_route():
+    body, status = handle_import_pets(get_db(), request.get_data(as_text=True), request.args, request.content_type)
+    return jsonify(body), status
+
+
+@app.get("/api/pets/export")
+def export_pets_route():
+    body, status = handle_export_pets(get_db(), request.args)
+    if status != 200:
+        return jsonify(body), status
+    fmt = request.args.get("format", "csv")
+    return Response(body, mimetype=PET_FORMATS[fmt], headers=pet_export_headers(fmt))
+
+
+@app.post("/api/pets/delete")
+def delete_pets_route():
+    body, status = handle_delete_pets(get_db(), request.get_json(silent=True))
+    return jsonify(body), status
+
+
+@app.route('/tag', methods=['POST'])
+def scan():
+    body, status = handle_scan(get_db(), request.get_json(silent=True))
+    return jsonify(body), status
+
+
+@app.post("/tag/lean")
+def scan_lean():
+    body, status = handle_lean_scan(get_db(), request.get_data(), request.args.get("feeder"))
+    return Response(body, status=status, mimetype=lean.CONTENT_TYPE)
+
+
+@app.get("/api/eligibility")
+def eligibility():
+    fmt = request.args.get("format", "json")
+    if fmt not in HINT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(HINT_FORMATS)}"}), 400
+    now = datetime.now()
+    etag = eligibility_etag(get_db(), now)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
     else:
-        log_event(None, "Unknown", "Denied", f"Unknown Tag: {tag_id}")
-        return jsonify({"status": "denied", "message": "Pet not recognized"}), 403
+        hints = load_hints(fmt, now)
+        response = jsonify(hints) if fmt == "json" else Response(hints, mimetype=HINT_FORMATS[fmt])
+    # Weak: wait_s counts down, but a client holding an older copy can
+    # count it down itself.
+    response.set_etag(etag, weak=True)
+    return response
+
+
+@app.route('/tag/batch', methods=['POST'])
+def scan_batch():
+    body, status = handle_batch(get_db(), request.get_json(silent=True))
+    return jsonify(body), status
 
 
 @app.route('/api/logs')
 def get_logs():
     db = get_db()
-    raw_logs = db.execute("""
-        SELECT pet_name, event_type, details, timestamp 
-        FROM feeding_logs 
-        ORDER BY timestamp DESC 
-        LIMIT 100
-    """).fetchall()
-
-    grouped_logs = []
-
-    for row in raw_logs:
-        current_log = dict(row)
-        current_log['count'] = 1
-
-        if grouped_logs:
-            last_log = grouped_logs[-1]
-            if (last_log['pet_name'] == current_log['pet_name'] and
-                    last_log['event_type'] == current_log['event_type'] and
-                    last_log['details'] == current_log['details']):
-                # Increment count on the displayed log (the most recent one)
-                last_log['count'] += 1
+    etag, generation, head = log_etag(db)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    response = jsonify(load_logs(
+        db, generation, head,
+        since=request.args.get("since", type=int),
+        client_generation=request.args.get("generation", type=int)
+    ))
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/api/logs/stream')
+def stream_logs():
+    cursor = bus.cursor(request.headers.get("Last-Event-ID", type=int))
+
+    def generate(cursor):
+        yield "retry: 3000\n\n"
+        while True:
+            if cursor is None:
+                yield "event: reset\ndata: {}\n\n"
+                cursor = bus.cursor()
+            events, cursor = bus.wait(cursor, STREAM_HEARTBEAT)
+            if cursor is None:
                 continue
+            if not events:
+                yield ": heartbeat\n\n"
+                continue
+            yield format_events(events)
+
+    return Response(generate(cursor), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), content_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/analytics")
+def analytics():
+    body, status = handle_analytics(get_db(), request.args)
+    return jsonify(body), status
+
+
+@app.get("/api/logs/export")
+def export_logs():
+    export, status = handle_export(request.args)
+    if status != 200:
+        return jsonify(export), status
+
+    def run(step):
+        # A pooled connection per chunk: the response outlives the request's
+        # app context, and writers are free between chunks.
+        db = pool.acquire()
+        try:
+            return step(db)
+        finally:
+            pool.release(db)
 
-        grouped_logs.append(current_log)
+    def generate():
+        yield run(export.start)
+        while (chunk := run(export.next_chunk)) is not None:
+            yield chunk
 
-    return jsonify(grouped_logs[:20])
+    return Response(generate(), mimetype=export.content_type, headers=export_headers(export))
 
 
 @app.route('/api/logs/clear', methods=['POST'])
 def clear_logs():
-    db = get_db()
-    db.execute("DELETE FROM feeding_logs")
-    db.commit()
-    return jsonify({"success": True})
+    return jsonify(handle_clear_logs(get_db()))
 
 
 HTML_PAGE = """
@@ -320,6 +933,10 @@ HTML_PAGE = """
                         <label for="name">Pet Name</label>
                         <input type="text" id="name" name="name" placeholder="e.g. Rex" required>
                     </div>
+                    <div class="form-group">
+                        <label for="feeder">Feeder ID (optional)</label>
+                        <input type="text" id="feeder" placeholder="Any feeder">
+                    </div>
                     <div class="form-group">
                         <label for="petUID">RFID Tag UID</label>
                         <div class="input-group">
@@ -404,8 +1021,14 @@ HTML_PAGE = """
 <script>
 let checkInt;
 
+function feederQuery() {
+    const feeder = document.getElementById('feeder').value.trim();
+    return feeder ? '?feeder=' + encodeURIComponent(feeder) : '';
+}
+
 function startScan() {
-    fetch('/start_registration', { method: 'POST' }).then(r => r.json()).then(d => {
+    clearInterval(checkInt);
+    fetch('/start_registration' + feederQuery(), { method: 'POST' }).then(r => r.json()).then(d => {
         const st = document.getElementById('status');
         st.className = 'alert alert-warning';
         st.style.display = 'block';
@@ -415,8 +1038,13 @@ function startScan() {
 }
 
 function checkUID() {
-    fetch('/get_captured_uid').then(r => r.json()).then(d => {
-        if (d.uid) {
+    fetch('/get_captured_uid' + feederQuery()).then(r => r.json()).then(d => {
+        if (d.error) {
+            clearInterval(checkInt);
+            const st = document.getElementById('status');
+            st.className = 'alert alert-warning';
+            st.innerText = '✗ ' + d.error;
+        } else if (d.uid) {
             clearInterval(checkInt);
             document.getElementById('petUID').value = d.uid;
             const st = document.getElementById('status');
@@ -442,116 +1070,148 @@ function clearLogs() {
     }
 }
 
-function fetchLogs() {
-    fetch('/api/logs')
-    .then(response => response.json())
-    .then(data => {
-        const container = document.getElementById('log-list');
-        if (data.length === 0) {
-            container.innerHTML = '<div class="empty-state" style="padding: 1rem;">No recent activity</div>';
-            return;
+let logs = [];
+
+function renderLogs() {
+    const container = document.getElementById('log-list');
+    if (logs.length === 0) {
+        container.innerHTML = '<div class="empty-state" style="padding: 1rem;">No recent activity</div>';
+        return;
+    }
+
+    let html = '';
+    logs.forEach(log => {
+        const isSuccess = log.event_type === 'Dispensed';
+        const badgeClass = isSuccess ? 'badge-success' : 'badge-destructive';
+        const timeStr = log.timestamp.split('.')[0]; 
+
+        // Logic for the counter badge
+        let counterHtml = '';
+        if (log.count > 1) {
+            counterHtml = `<span class="counter-badge">× ${log.count}</span>`;
         }
 
-        let html = '';
-        data.forEach(log => {
-            const isSuccess = log.event_type === 'Dispensed';
-            const badgeClass = isSuccess ? 'badge-success' : 'badge-destructive';
-            const timeStr = log.timestamp.split('.')[0]; 
-
-            // Logic for the counter badge
-            let counterHtml = '';
-            if (log.count > 1) {
-                counterHtml = `<span class="counter-badge">× ${log.count}</span>`;
-            }
-
-            html += `
-            <div class="pet-item">
-                <div class="pet-info">
-                    <div style="display: flex; align-items: center;">
-                        <div class="pet-name">${log.pet_name}</div>
-                        ${counterHtml}
-                    </div>
-                    <div class="pet-details">
-                        <span>${timeStr}</span> • <span>${log.details}</span>
-                    </div>
+        html += `
+        <div class="pet-item">
+            <div class="pet-info">
+                <div style="display: flex; align-items: center;">
+                    <div class="pet-name">${log.pet_name}</div>
+                    ${counterHtml}
+                </div>
+                <div class="pet-details">
+                    <span>${timeStr}</span> • <span>${log.details}</span>
                 </div>
-                <span class="badge ${badgeClass}">${log.event_type}</span>
             </div>
-            `;
-        });
-        container.innerHTML = html;
+            <span class="badge ${badgeClass}">${log.event_type}</span>
+        </div>
+        `;
+    });
+    container.innerHTML = html;
 
-        const indicator = document.getElementById('live-indicator');
-        indicator.style.opacity = '0.5';
-        setTimeout(() => indicator.style.opacity = '1', 200);
+    const indicator = document.getElementById('live-indicator');
+    indicator.style.opacity = '0.5';
+    setTimeout(() => indicator.style.opacity = '1', 200);
+}
+
+function fetchLogs() {
+    fetch('/api/logs')
+    .then(response => response.json())
+    .then(data => {
+        logs = data;
+        renderLogs();
     });
 }
 
-setInterval(fetchLogs, 2000);
+function addLog(log) {
+    // Repeats of the newest entry arrive as the same group with a higher count
+    if (logs.length && logs[0].group_id === log.group_id) {
+        logs[0] = log;
+    } else {
+        logs.unshift(log);
+        logs = logs.slice(0, 20);
+    }
+    renderLogs();
+}
+
+function updateCount(group) {
+    const log = logs.find(log => log.group_id === group.group_id);
+    if (log) {
+        log.count = group.count;
+        renderLogs();
+    }
+}
+
+if (window.EventSource) {
+    const stream = new EventSource('/api/logs/stream');
+    stream.addEventListener('log', e => addLog(JSON.parse(e.data)));
+    stream.addEventListener('group', e => updateCount(JSON.parse(e.data)));
+    stream.addEventListener('reset', fetchLogs);
+} else {
+    setInterval(fetchLogs, 2000);
+}
 fetchLogs();
 </script>
 </body>
 </html>
 """
 
+dashboard = app.jinja_env.from_string(HTML_PAGE)
+dashboard_lock = threading.Lock()
+# "page" is (html, expires_at); "version" is bumped by every invalidation so a
+# render that raced with one is not stored.
+dashboard_cache = {"page": None, "version": 0}
+
+
+def cached_dashboard():
+    page = dashboard_cache["page"]
+    if page is not None and time.monotonic() < page[1]:
+        return page[0]
+    return None
+
+
+def render_dashboard(db):
+    version = dashboard_cache["version"]
+    html = dashboard.render(pets=list_pets(db))
+    with dashboard_lock:
+        if dashboard_cache["version"] == version:
+            dashboard_cache["page"] = (html, time.monotonic() + DASHBOARD_MAX_AGE)
+    return html
+
+
+def invalidate_dashboard():
+    with dashboard_lock:
+        dashboard_cache["version"] += 1
+        dashboard_cache["page"] = None
+
 
 @app.route("/")
 def index():
-    init_db()
-    db = get_db()
-    pets = db.execute("SELECT * FROM pets").fetchall()
-    return render_template_string(HTML_PAGE, pets=pets)
+    return cached_dashboard() or render_dashboard(get_db())
 
 
 @app.post("/start_registration")
 def start_registration():
-    pending_registration["active"] = True
-    pending_registration["last_uid"] = None
-    return jsonify({"status": "ready"})
+    return jsonify(begin_registration(get_db(), request.values.get("feeder")))
 
 
 @app.get("/get_captured_uid")
 def get_captured_uid():
-    uid = pending_registration.get("last_uid")
-    if uid:
-        pending_registration["last_uid"] = None
-        return jsonify({"uid": uid})
-    return jsonify({"uid": None})
+    return jsonify(take_captured_uid(get_db(), request.values.get("feeder")))
 
 
 @app.post("/register")
 def register_pet():
-    name = request.form.get("name")
-    uid = request.form.get("uid")
-    portion = request.form.get("portion")
-    cooldown = request.form.get("cooldown")
-    max_feeds = request.form.get("max_feeds")
-
-    if not name or not uid:
-        return "Missing Data", 400
-
-    db = get_db()
-    try:
-        db.execute("""
-            INSERT INTO pets (name, rfid_uid, portion_size, cooldown_min, max_daily_feeds) 
-            VALUES (?, ?, ?, ?, ?)
-        """, (name, uid, portion, cooldown, max_feeds))
-        db.commit()
-    except Exception as e:
-        return f"Error: {e}", 500
-
-    return ("<script>window.location='/'</script>")
+    return handle_register(get_db(), request.form)
 
 
 @app.post("/delete/<int:pet_id>")
 def delete_pet(pet_id):
-    db = get_db()
-    db.execute("DELETE FROM pets WHERE id = ?", (pet_id,))
-    db.execute("DELETE FROM feeding_logs WHERE pet_id = ?", (pet_id,))
-    db.commit()
-    return jsonify({"success": True})
+    return jsonify(handle_delete_pet(get_db(), pet_id))
 
 
 if __name__ == "__main__":
     init_db()
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    warm_engine()
+    retention.start()
+    purger.start()
+    app.run(host="0.0.0.0", port=int(os.environ.get("PET_FEEDER_PORT", 5000)))